@@ -1,12 +1,25 @@
+import asyncio
 from datetime import datetime
+from functools import lru_cache
+import json
+from typing import NotRequired, TypedDict
 from langchain.agents import create_agent
+from langchain.agents.middleware import AgentMiddleware, AgentState, ModelRequest, SummarizationMiddleware, after_model, dynamic_prompt
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.runtime import Runtime
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.tools import StructuredTool
-from langgraph.checkpoint.postgres import PostgresSaver
-from psycopg import connect
-from sqlalchemy import text
-from database import get_db, Expenses
-from sqlalchemy.orm import Session
+from langchain.tools import ToolRuntime
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from database import session_scope, Expenses, Granularity
+from analytics import period_totals, category_breakdown, net_summary, apply_rollup, rollup_row
+from cache import TTLCache
+from sql_guard import run_query
+from metrics import instrument_checkpointer
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -15,14 +28,53 @@ load_dotenv()
 POSTGRES_URI = os.getenv("POSTGRES_URI")
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-conn = connect(POSTGRES_URI)
-conn.autocommit = True  # Required for concurrent index creation
-saver = PostgresSaver(conn)
-saver.setup()  # ✅ Run once at startup
-
-# --- SQLAlchemy session setup ---
-db = next(get_db())
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# "compact": short tool descriptions and a static system prompt; "full": the original long prompts.
+PROMPT_MODE = os.getenv("PROMPT_MODE", "compact")
+
+# Pool and saver are created lazily on the worker's event loop (see ensure_checkpointer).
+pool = None
+saver = None
+_saver_lock = asyncio.Lock()
+# Checkpoint tables are created by `python manage.py migrate`; set this to create them per worker instead.
+CHECKPOINT_AUTO_SETUP = os.getenv("CHECKPOINT_AUTO_SETUP", "false").lower() == "true"
+_CONNECTION_KWARGS = {"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row}  # autocommit is required for concurrent index creation
+
+
+async def ensure_checkpointer():
+    global pool, saver
+    if saver is not None:
+        return saver
+    async with _saver_lock:
+        if saver is None:
+            pool = AsyncConnectionPool(
+                POSTGRES_URI,
+                min_size=int(os.getenv("CHECKPOINT_POOL_MIN", "1")),
+                max_size=int(os.getenv("CHECKPOINT_POOL_MAX", "10")),
+                open=False,
+                kwargs=_CONNECTION_KWARGS,
+            )
+            await pool.open()
+            checkpointer = instrument_checkpointer(AsyncPostgresSaver(pool))
+            if CHECKPOINT_AUTO_SETUP:
+                await checkpointer.setup()
+            saver = checkpointer
+    return saver
+
+
+async def setup_checkpointer():
+    """Create or upgrade the checkpoint tables over a single connection (used by manage.py migrate)."""
+    async with await AsyncConnection.connect(POSTGRES_URI, **_CONNECTION_KWARGS) as conn:
+        await AsyncPostgresSaver(conn).setup()
+
+
+async def close_checkpointer():
+    global pool, saver
+    async with _saver_lock:
+        if pool is not None:
+            await pool.close()
+        pool = saver = None
+        agent_registry.clear()  # compiled graphs hold the closed saver
 
 # ------------------------------------------------------------------
 # 🔹 Helper: Build prompt dynamically
@@ -39,25 +91,20 @@ User input: {query}
 """
 
 
-def safe_sql_query(query: str):
-    if "users" in query.lower() and "expenses" not in query.lower():
-        return "Access to other user data is restricted."
+# Tools take the user from the invoke-time context, never from model-written arguments.
+def _caller_id(runtime: ToolRuntime[dict]) -> int:
+    return int(runtime.context["user_id"])
 
-    query = query.replace("strftime('%Y-%m', date)", "TO_CHAR(date, 'YYYY-MM')")
 
-    allowed = ("select", "insert")
-    qtype = query.strip().lower().split()[0]
-    print(query)
+def safe_sql_query(query: str, runtime: ToolRuntime[dict]):
+    return run_query(query, _caller_id(runtime))
 
-    if qtype in allowed:
-        result = db.execute(text(query))
-        db.commit()
-        return result
-
-    return "NO permission to modify the database."
+async def asafe_sql_query(query: str, runtime: ToolRuntime[dict]):
+    return await asyncio.to_thread(safe_sql_query, query, runtime)
 
 execute_query = StructuredTool.from_function(
     func=safe_sql_query,
+    coroutine=asafe_sql_query,
     name="Execute_Safe_sql_Query",
     description="""
 You are an Expense Tracker query tool for user_id=user_id.
@@ -67,57 +114,74 @@ Rules:
 3️⃣ Never access or reveal other users' data.
 4️⃣ When adding a new expense, always ask the user for confirmation before inserting.
 5️⃣ Respond politely and clearly. Use proper SQL syntax for queries.
+6️⃣ Every SELECT must filter each expenses table with user_id = <the user's id>; INSERTs must list their columns. Results are capped, so aggregate in SQL instead of fetching all rows.
 """
 )
 
-def fetch_expenses(user_id: int):
-    db: Session = next(get_db())
-    expenses = (
-        db.query(Expenses)
-        .filter(Expenses.user_id == user_id)
-        .order_by(Expenses.date.desc())
-        .limit(10)
-        .all()
-    )
-    if not expenses:
-        return "No expenses found for this user."
-    return [
-        {"id": e.id, "category": e.category, "amount": e.amount, "date": str(e.date)}
-        for e in expenses
-    ]
+def fetch_expenses(user_id: int, limit: int = 10):
+    with session_scope() as db:
+        expenses = (
+            db.query(Expenses)
+            .filter(Expenses.user_id == user_id)
+            .order_by(Expenses.date.desc())
+            .limit(limit)
+            .all()
+        )
+        if not expenses:
+            return "No expenses found for this user."
+        return [
+            {"id": e.id, "category": e.category, "amount": e.amount, "date": str(e.date)}
+            for e in expenses
+        ]
+
+def fetch_own_expenses(runtime: ToolRuntime[dict]):
+    return fetch_expenses(_caller_id(runtime))
+
+async def afetch_own_expenses(runtime: ToolRuntime[dict]):
+    return await asyncio.to_thread(fetch_own_expenses, runtime)
 
 fetch_Expenses = StructuredTool.from_function(
     name="Fetch_Expenses",
-    func=fetch_expenses,
+    func=fetch_own_expenses,
+    coroutine=afetch_own_expenses,
     description="Fetch the user's 10 most recent expenses from the database."
 )
 
 
 def update_record(user_id, record_id, category=None, amount=None, amount_type=None, date=None, confirmation=False):
     user_id = int(user_id)
-    db = next(get_db())
-    record = db.query(Expenses).filter(Expenses.id == record_id, Expenses.user_id == user_id).first()
-    if not record:
-        return f"No record found with ID {record_id}"
-
-    if category:
-        record.category = category
-    if amount:
-        record.amount = amount
-    if amount_type:
-        record.amount_type = amount_type
-    if date:
-        record.date = datetime.strptime(date, "%Y-%m-%d").date()
-
-    if confirmation:
-        db.commit()
-        return "✅ Record updated successfully."
-    else:
-        return "Please confirm before updating the record."
+    with session_scope() as db:
+        record = db.query(Expenses).filter(Expenses.id == record_id, Expenses.user_id == user_id).with_for_update().first()
+        if not record:
+            return f"No record found with ID {record_id}"
+
+        before = rollup_row(record)
+        if category:
+            record.category = category
+        if amount:
+            record.amount = amount
+        if amount_type:
+            record.amount_type = amount_type
+        if date:
+            record.date = datetime.strptime(date, "%Y-%m-%d").date()
+
+        if confirmation:
+            apply_rollup(db, user_id, added=[rollup_row(record)], removed=[before])
+            db.commit()
+            return "✅ Record updated successfully."
+        else:
+            return "Please confirm before updating the record."
+
+def update_own_record(runtime: ToolRuntime[dict], record_id, category=None, amount=None, amount_type=None, date=None, confirmation=False):
+    return update_record(_caller_id(runtime), record_id, category, amount, amount_type, date, confirmation)
+
+async def aupdate_own_record(runtime: ToolRuntime[dict], record_id, category=None, amount=None, amount_type=None, date=None, confirmation=False):
+    return await asyncio.to_thread(update_own_record, runtime, record_id, category, amount, amount_type, date, confirmation)
 
 update_user_record = StructuredTool.from_function(
     name="Update_User_Record",
-    func=update_record,
+    func=update_own_record,
+    coroutine=aupdate_own_record,
     description="""
 You are an intelligent and conversational Expense Assistant. Your goal is to safely update expense records for a single user. Follow these rules strictly:
 Strict Rule: If the user gives his earning or deals to add ADD it in the Database here amount_type =CREDIT remember this one
@@ -161,19 +225,27 @@ Assistant: Update cancelled. No changes were made.
 def delete_record(user_id=None, record_id=None, confirmation=False):
     if not user_id or not record_id:
         return " user_id and record_id are required."
-    db = next(get_db())
-    record = db.query(Expenses).filter(Expenses.user_id == user_id, Expenses.id == record_id).first()
-    if not record:
-        return f"No record found with ID {record_id}."
-    if not confirmation:
-        return "Please confirm before deletion."
-    db.delete(record)
-    db.commit()
+    with session_scope() as db:
+        record = db.query(Expenses).filter(Expenses.user_id == user_id, Expenses.id == record_id).with_for_update().first()
+        if not record:
+            return f"No record found with ID {record_id}."
+        if not confirmation:
+            return "Please confirm before deletion."
+        db.delete(record)
+        apply_rollup(db, int(user_id), removed=[rollup_row(record)])
+        db.commit()
     return "Record deleted successfully."
 
+def delete_own_record(runtime: ToolRuntime[dict], record_id=None, confirmation=False):
+    return delete_record(_caller_id(runtime), record_id, confirmation)
+
+async def adelete_own_record(runtime: ToolRuntime[dict], record_id=None, confirmation=False):
+    return await asyncio.to_thread(delete_own_record, runtime, record_id, confirmation)
+
 delete_user_record = StructuredTool.from_function(
     name="Delete_Record",
-    func=delete_record,
+    func=delete_own_record,
+    coroutine=adelete_own_record,
     description="""
 You are an intelligent and conversational Expense Assistant. Your goal is to safely delete expense records for a single user. Follow these rules strictly:
 
@@ -213,14 +285,88 @@ Assistant: Record ID 101 has been successfully deleted.
 """
 )
 
-tools = [execute_query, fetch_Expenses, update_user_record, delete_user_record]
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+
+def _jsonable(row: dict) -> dict:
+    return {k: (v.value if hasattr(v, "value") else str(v) if hasattr(v, "isoformat") else v) for k, v in row.items()}
+
 
+def expense_summary(user_id: int, summary: str = "totals", granularity: str = "month",
+                    start_date: str = None, end_date: str = None, category: str = None):
+    start, end = _parse_date(start_date), _parse_date(end_date)
+    with session_scope() as db:
+        if summary == "categories":
+            rows = category_breakdown(db, int(user_id), start, end)
+        elif summary == "net":
+            return _jsonable(net_summary(db, int(user_id), start, end, category))
+        else:
+            rows = period_totals(db, int(user_id), Granularity(granularity), start, end, category)
+    if not rows:
+        return "No expenses found for this period."
+    return [_jsonable(row) for row in rows]
 
-def get_agent(user_id: int):
-    session_id = f"Session_{user_id}"
+def own_expense_summary(runtime: ToolRuntime[dict], summary: str = "totals", granularity: str = "month",
+                        start_date: str = None, end_date: str = None, category: str = None):
+    return expense_summary(_caller_id(runtime), summary, granularity, start_date, end_date, category)
 
-    tool_names = [tool.name for tool in tools]
-    system_message =f"""
+async def aown_expense_summary(runtime: ToolRuntime[dict], summary: str = "totals", granularity: str = "month",
+                               start_date: str = None, end_date: str = None, category: str = None):
+    return await asyncio.to_thread(own_expense_summary, runtime, summary, granularity, start_date, end_date, category)
+
+expense_Summary = StructuredTool.from_function(
+    name="Expense_Summary",
+    func=own_expense_summary,
+    coroutine=aown_expense_summary,
+    description="""
+Aggregated spending for the user, computed by the database. Prefer this over writing SQL for totals.
+- summary="totals": debit/credit/net per period; granularity is "day", "week" or "month".
+- summary="categories": total and count per category and amount_type.
+- summary="net": overall debit vs credit.
+Optional filters: start_date / end_date as YYYY-MM-DD, category.
+"""
+)
+
+tools = [execute_query, fetch_Expenses, update_user_record, delete_user_record, expense_Summary]
+tool_names = [tool.name for tool in tools]
+
+# Tool descriptions are resent on every model call; compact mode keeps the rules and drops the
+# example conversations (the confirm-before-write flow is stated once in the system prompt).
+COMPACT_DESCRIPTIONS = {
+    "Execute_Safe_sql_Query": (
+        "Run one PostgreSQL SELECT or INSERT on expenses(id, user_id, category, amount, amount_type 'DEBIT'|'CREDIT', date). "
+        "Filter every read with user_id = <user id>; list the columns on INSERT and only insert after the user confirms. "
+        "Results are capped, so aggregate in SQL."
+    ),
+    "Fetch_Expenses": fetch_Expenses.description,
+    "Update_User_Record": (
+        "Update one of the user's expenses by record_id. Earnings/income are amount_type CREDIT. "
+        "Call with confirmation=true only after the user approved the repeated-back change."
+    ),
+    "Delete_Record": (
+        "Delete one of the user's expenses by record_id. "
+        "Call with confirmation=true only after the user approved the repeated-back record."
+    ),
+    "Expense_Summary": (
+        'Database-computed aggregates; prefer over SQL for totals. summary="totals" (per day/week/month granularity), '
+        '"categories" (per category and amount_type) or "net" (debit vs credit). Optional start_date/end_date (YYYY-MM-DD), category.'
+    ),
+}
+if PROMPT_MODE == "compact":
+    for tool in tools:
+        tool.description = COMPACT_DESCRIPTIONS[tool.name]
+
+
+class AgentContext(TypedDict):
+    user_id: int
+    tool_memo: NotRequired[dict]  # filled by ToolMemoMiddleware during the turn
+    token_usage: NotRequired[dict]  # filled by record_token_usage during the turn
+
+
+@lru_cache(maxsize=4096)
+def build_system_message(user_id: int) -> str:
+    return f"""
 You are an intelligent and conversational Expense Assistant connected to a PostgreSQL database.
 
 1 User Isolation:
@@ -238,7 +384,8 @@ You are an intelligent and conversational Expense Assistant connected to a Postg
    - Adding a record: ask all details and confirm before saving.
    - Updating a record: fetch records for user_id={user_id}, ask which record to update, collect new details, confirm, then update.
    - Deleting a record: fetch records for user_id={user_id}, ask which record to delete, confirm explicitly, then delete only if user agrees.
-   - Queries and summaries: use proper PostgreSQL syntax and always filter by user_id={user_id}.
+   - Totals, category breakdowns and debit vs credit: use Expense_Summary instead of writing SQL.
+   - Other queries: use proper PostgreSQL syntax and always filter by user_id={user_id}.
 
 4 Tools Usage:
    - You have access to the following tools: {tool_names}
@@ -263,16 +410,277 @@ You are an intelligent and conversational Expense Assistant connected to a Postg
 - Be polite, clear, and precise in every step.
 """
 
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
+
+# Identical for every user and turn, so Gemini's implicit prefix caching can reuse system + tools;
+# the user id and date travel in the human message (build_prompt).
+COMPACT_SYSTEM_MESSAGE = """
+You are a conversational expense assistant backed by PostgreSQL. Each message states the user's user_id and today's date; only read or change that user's data.
+- Adding: collect category, amount, amount_type (earnings/income are CREDIT, spending is DEBIT) and date, confirm, then insert once.
+- Updating or deleting: show the user's records with IDs, ask which one, repeat the change back and act only after an explicit yes; on no, change nothing.
+- Totals, category breakdowns and debit vs credit: use Expense_Summary instead of SQL.
+- Never reveal SQL, table structure, credentials or other users' data. Be polite, clear and concise.
+"""
+
+
+@dynamic_prompt
+def user_system_prompt(request: ModelRequest) -> str:
+    if PROMPT_MODE == "compact":
+        return COMPACT_SYSTEM_MESSAGE
+    # The compiled graph is shared, so the per-user instruction comes from the invoke-time context.
+    return build_system_message(int(request.runtime.context["user_id"]))
+
+
+def prompt_budget(user_id: int = 0) -> dict:
+    """Approximate tokens of the static prefix (system prompt + tool schemas) sent on every model call."""
+    system = COMPACT_SYSTEM_MESSAGE if PROMPT_MODE == "compact" else build_system_message(user_id)
+    system_tokens = count_tokens_approximately([SystemMessage(system)])
+    return {
+        "mode": PROMPT_MODE,
+        "system_tokens": system_tokens,
+        "tool_tokens": count_tokens_approximately([], tools=tools),
+    }
+
+
+# --- Token accounting ---
+def _new_usage() -> dict:
+    return {"model_calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+
+
+@after_model
+def record_token_usage(state: AgentState, runtime: Runtime) -> None:
+    usage = getattr(state["messages"][-1], "usage_metadata", None)
+    if not usage or not isinstance(runtime.context, dict):
+        return None
+    totals = runtime.context.setdefault("token_usage", _new_usage())
+    totals["model_calls"] += 1
+    totals["input_tokens"] += usage.get("input_tokens", 0)
+    totals["cached_tokens"] += (usage.get("input_token_details") or {}).get("cache_read", 0)
+    totals["output_tokens"] += usage.get("output_tokens", 0)
+    return None
+
+
+def log_turn_usage(context: dict, elapsed: float):
+    usage = context.get("token_usage") or _new_usage()
+    print(
+        f"chat turn user={context['user_id']} mode={PROMPT_MODE} model_calls={usage['model_calls']} "
+        f"input_tokens={usage['input_tokens']} cached_tokens={usage['cached_tokens']} "
+        f"output_tokens={usage['output_tokens']} latency_ms={elapsed * 1000:.0f}"
+    )
+
+
+# --- Per-turn tool memo ---
+READ_ONLY_TOOLS = {"Fetch_Expenses", "Expense_Summary"}
+
+
+def is_read_only_call(call: dict) -> bool:
+    if call["name"] in READ_ONLY_TOOLS:
+        return True
+    if call["name"] == execute_query.name:
+        return str(call.get("args", {}).get("query", "")).strip().lower().startswith("select")
+    return False
+
+
+class ToolMemoMiddleware(AgentMiddleware):
+    """Reuse read-only tool results within one turn; any other tool call clears the memo.
+
+    The memo lives in the invoke-time context dict, so it never outlives the turn.
+    Tool calls of one model step already run concurrently in the tool node.
+    """
+
+    @staticmethod
+    def _memo(request):
+        context = request.runtime.context if request.runtime is not None else None
+        return context.setdefault("tool_memo", {}) if isinstance(context, dict) else None
+
+    @staticmethod
+    def _key(call: dict):
+        return call["name"], json.dumps(call["args"], sort_keys=True, default=str)
+
+    @staticmethod
+    def _replay(message: ToolMessage, call: dict) -> ToolMessage:
+        return message.model_copy(update={"tool_call_id": call["id"], "id": None})
+
+    def wrap_tool_call(self, request, handler):
+        memo = self._memo(request)
+        call = request.tool_call
+        if memo is None:
+            return handler(request)
+        if not is_read_only_call(call):
+            memo.clear()
+            try:
+                return handler(request)
+            finally:
+                memo.clear()  # drop reads that finished while the write ran
+        key = self._key(call)
+        cached = memo.get(key)
+        if isinstance(cached, ToolMessage):
+            return self._replay(cached, call)
+        result = handler(request)
+        if isinstance(result, ToolMessage) and result.status != "error":
+            memo[key] = result
+        return result
+
+    async def awrap_tool_call(self, request, handler):
+        memo = self._memo(request)
+        call = request.tool_call
+        if memo is None:
+            return await handler(request)
+        if not is_read_only_call(call):
+            memo.clear()
+            try:
+                return await handler(request)
+            finally:
+                memo.clear()
+        key = self._key(call)
+        cached = memo.get(key)
+        if cached is not None:
+            # Identical calls in the same step share the first one's in-flight result.
+            message = await asyncio.shield(cached) if isinstance(cached, asyncio.Future) else cached
+            return self._replay(message, call) if isinstance(message, ToolMessage) else message
+        future = asyncio.get_running_loop().create_future()
+        memo[key] = future
+        try:
+            result = await handler(request)
+        except BaseException as e:
+            memo.pop(key, None)
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        future.set_result(result)
+        if memo.get(key) is future:
+            if isinstance(result, ToolMessage) and result.status != "error":
+                memo[key] = result
+            else:
+                memo.pop(key, None)
+        return result
+
+
+tool_memo = ToolMemoMiddleware()
+
+
+# --- Conversation memory ---
+MEMORY_MAX_TOKENS = int(os.getenv("CHAT_MEMORY_MAX_TOKENS", "4000"))
+MEMORY_KEEP_MESSAGES = int(os.getenv("CHAT_MEMORY_KEEP_MESSAGES", "12"))
+CHECKPOINTS_TO_KEEP = int(os.getenv("CHECKPOINTS_TO_KEEP", "2"))
+
+_PRUNE_CHECKPOINTS = (
+    # Keep only the newest checkpoints of the thread (checkpoint ids are time-ordered uuid6).
+    """
+    DELETE FROM checkpoints c
+    USING (
+        SELECT checkpoint_ns, checkpoint_id,
+               row_number() OVER (PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+        FROM checkpoints WHERE thread_id = %(thread_id)s
+    ) old
+    WHERE c.thread_id = %(thread_id)s AND c.checkpoint_ns = old.checkpoint_ns
+      AND c.checkpoint_id = old.checkpoint_id AND old.rn > %(keep)s
+    """,
+    """
+    DELETE FROM checkpoint_writes w
+    WHERE w.thread_id = %(thread_id)s AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = w.thread_id AND c.checkpoint_ns = w.checkpoint_ns AND c.checkpoint_id = w.checkpoint_id
+    )
+    """,
+    # Channel blobs are shared between checkpoints; drop versions no remaining checkpoint references.
+    """
+    DELETE FROM checkpoint_blobs b
+    WHERE b.thread_id = %(thread_id)s AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c, jsonb_each_text(c.checkpoint -> 'channel_versions') v
+        WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+          AND v.key = b.channel AND v.value = b.version
+    )
+    """,
+)
+
+
+async def prune_checkpoints(thread_id, keep: int = CHECKPOINTS_TO_KEEP):
+    """Delete superseded checkpoint versions of a thread."""
+    await ensure_checkpointer()
+    try:
+        async with pool.connection() as conn:
+            async with conn.transaction():
+                for statement in _PRUNE_CHECKPOINTS:
+                    await conn.execute(statement, {"thread_id": str(thread_id), "keep": keep})
+    except Exception as e:
+        print(f"Checkpoint pruning failed for thread {thread_id}: {e}")
+
+
+def _message_text(message) -> str:
+    if isinstance(message.content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in message.content)
+    return str(message.content)
+
+
+async def last_reply(thread_id) -> str:
+    """Text of the thread's latest AI message, or "" for a new thread."""
+    await ensure_checkpointer()
+    latest = await saver.aget_tuple({"configurable": {"thread_id": str(thread_id)}})
+    if latest is None:
+        return ""
+    for message in reversed(latest.checkpoint["channel_values"].get("messages", [])):
+        if message.type == "ai":
+            return _message_text(message)
+    return ""
+
+
+async def append_turn(thread_id, prompt: str, answer: str):
+    """Record a turn answered without running the agent, so the thread's history matches what the user saw."""
+    await ensure_checkpointer()
+    await get_agent().aupdate_state(
+        {"configurable": {"thread_id": thread_id}},
+        {"messages": [HumanMessage(content=prompt), AIMessage(content=answer)]},
+        as_node="model",
+    )
+
+
+# --- Agent registry: compiled graphs are shared across users ---
+agent_registry = TTLCache(
+    max_size=int(os.getenv("AGENT_CACHE_SIZE", "4")),
+    ttl=float(os.getenv("AGENT_CACHE_TTL", "3600")),
+)
+
+
+def create_chat_model(model: str, temperature: float):
+    return ChatGoogleGenerativeAI(
+        model=model,
         google_api_key=GEMINI_API_KEY,
-        temperature=0.7,
-        model_kwargs={"system_instruction": system_message}
+        temperature=temperature,
     )
 
-    agent = create_agent(
+
+chat_model_factory = create_chat_model
+
+
+def set_chat_model_factory(factory=None):
+    """Swap the chat model constructor, e.g. for the offline benchmarks; None restores Gemini."""
+    global chat_model_factory
+    chat_model_factory = factory or create_chat_model
+    agent_registry.clear()
+
+
+def _build_agent(model: str):
+    if saver is None:
+        raise RuntimeError("ensure_checkpointer() must be awaited before building the agent")
+    llm = chat_model_factory(model, 0.7)
+    summarizer = chat_model_factory(model, 0)
+    # Older turns are folded into a running summary so each turn sends a bounded history.
+    memory = SummarizationMiddleware(
+        model=summarizer,
+        max_tokens_before_summary=MEMORY_MAX_TOKENS,
+        messages_to_keep=MEMORY_KEEP_MESSAGES,
+    )
+    budget = prompt_budget()
+    print(f"Agent {model}: prompt mode {budget['mode']}, static prefix ~{budget['system_tokens'] + budget['tool_tokens']} tokens")
+    return create_agent(
         llm,
         tools=tools,
+        middleware=[memory, user_system_prompt, tool_memo, record_token_usage],
+        context_schema=AgentContext,
         checkpointer=saver
     )
-    return agent
+
+
+def get_agent(model: str = GEMINI_MODEL):
+    """Return the shared agent graph; invoke it with context={"user_id": ...}."""
+    return agent_registry.get_or_create(model, lambda: _build_agent(model))
@@ -0,0 +1,210 @@
+import argparse
+from datetime import date, timedelta
+from types import SimpleNamespace
+from typing import Optional
+from sqlalchemy import Date, case, cast, func, insert, literal_column, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from database import Expenses, ExpenseMonthlyRollup, AmountType, Granularity, session_scope
+
+
+# Aggregates are computed in Postgres with GROUP BY. Month-aligned reads come
+# from expense_monthly_rollup (O(months x categories)); anything finer falls
+# back to date_trunc over expenses, whose user_id/date filters use idx_expenses_user_date_id.
+
+def _period(granularity: Granularity):
+    # Inlined (from a closed enum) so SELECT and GROUP BY render the same expression.
+    unit = literal_column(f"'{Granularity(granularity).value}'")
+    return cast(func.date_trunc(unit, Expenses.date), Date)
+
+
+def _rollup_covers(granularity: Optional[Granularity], start: Optional[date], end: Optional[date]) -> bool:
+    if granularity not in (None, Granularity.MONTH):
+        return False
+    if start and start.day != 1:
+        return False
+    if end and (end + timedelta(days=1)).day != 1:
+        return False
+    return True
+
+
+def _source(user_id: int, granularity: Optional[Granularity], start: Optional[date], end: Optional[date]):
+    if _rollup_covers(granularity, start, end):
+        R = ExpenseMonthlyRollup
+        filters = [R.user_id == user_id]
+        if start:
+            filters.append(R.month >= start)
+        if end:
+            filters.append(R.month <= end.replace(day=1))
+        return SimpleNamespace(period=R.month, category=R.category, amount_type=R.amount_type,
+                               amount=R.total, count=func.sum(R.count), filters=filters)
+
+    filters = [Expenses.user_id == user_id, Expenses.date.isnot(None)]
+    if start:
+        filters.append(Expenses.date >= start)
+    if end:
+        filters.append(Expenses.date <= end)
+    return SimpleNamespace(period=_period(granularity or Granularity.MONTH), category=Expenses.category,
+                           amount_type=Expenses.amount_type, amount=Expenses.amount,
+                           count=func.count(Expenses.id), filters=filters)
+
+
+def _typed_sum(src, kind: AmountType):
+    return func.coalesce(func.sum(case((src.amount_type == kind, src.amount), else_=0.0)), 0.0)
+
+
+def period_totals(db: Session, user_id: int, granularity: Granularity = Granularity.MONTH,
+                  start: Optional[date] = None, end: Optional[date] = None, category: Optional[str] = None):
+    src = _source(user_id, granularity, start, end)
+    period = src.period.label("period")
+    query = db.query(period, _typed_sum(src, AmountType.DEBIT), _typed_sum(src, AmountType.CREDIT), src.count)
+    query = query.filter(*src.filters)
+    if category:
+        query = query.filter(src.category == category)
+    rows = query.group_by(period).order_by(period).all()
+    return [
+        {"period": p, "debit": d, "credit": c, "net": c - d, "count": n}
+        for p, d, c, n in rows
+    ]
+
+
+def category_breakdown(db: Session, user_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                       granularity: Optional[Granularity] = None, amount_type: Optional[AmountType] = None):
+    src = _source(user_id, granularity, start, end)
+    columns = [src.category, src.amount_type]
+    if granularity:
+        columns.insert(0, src.period.label("period"))
+    query = db.query(*columns, func.sum(src.amount), src.count).filter(*src.filters)
+    if amount_type:
+        query = query.filter(src.amount_type == amount_type)
+    rows = query.group_by(*columns).order_by(*columns).all()
+    result = []
+    for row in rows:
+        *keys, total, count = row
+        period = keys.pop(0) if granularity else None
+        category, kind = keys
+        result.append({"period": period, "category": category, "amount_type": kind, "total": total, "count": count})
+    return result
+
+
+def net_summary(db: Session, user_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                category: Optional[str] = None):
+    src = _source(user_id, None, start, end)
+    query = db.query(_typed_sum(src, AmountType.DEBIT), _typed_sum(src, AmountType.CREDIT), func.coalesce(src.count, 0))
+    query = query.filter(*src.filters)
+    if category:
+        query = query.filter(src.category == category)
+    debit, credit, count = query.one()
+    return {"debit": debit, "credit": credit, "net": credit - debit, "count": count}
+
+
+# --- Rollup maintenance ---
+
+def _amount_type(value) -> AmountType:
+    if isinstance(value, AmountType):
+        return value
+    return AmountType[value.upper()] if value.upper() in AmountType.__members__ else AmountType(value)
+
+
+def rollup_row(record):
+    """The (date, category, amount_type, amount) of an Expenses row as it contributes to the rollup."""
+    return (record.date, record.category, record.amount_type, record.amount)
+
+
+def apply_rollup(db: Session, user_id: int, added=(), removed=()):
+    """Apply rollup deltas for rows added/removed in the caller's transaction (caller commits)."""
+    deltas = {}
+    for sign, rows in ((1, added), (-1, removed)):
+        for row_date, category, kind, amount in rows:
+            if row_date is None:
+                continue
+            key = (row_date.replace(day=1), category, _amount_type(kind))
+            total, count = deltas.get(key, (0.0, 0))
+            deltas[key] = (total + sign * float(amount), count + sign)
+    values = [
+        {"user_id": user_id, "month": month, "category": category, "amount_type": kind, "total": total, "count": count}
+        for (month, category, kind), (total, count) in deltas.items()
+        if count or total
+    ]
+    if not values:
+        return
+
+    stmt = pg_insert(ExpenseMonthlyRollup).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "month", "category", "amount_type"],
+        set_={
+            "total": ExpenseMonthlyRollup.total + stmt.excluded.total,
+            "count": ExpenseMonthlyRollup.count + stmt.excluded.count,
+        },
+    )
+    db.execute(stmt)
+    if any(v["count"] < 0 for v in values):
+        db.query(ExpenseMonthlyRollup).filter(
+            ExpenseMonthlyRollup.user_id == user_id, ExpenseMonthlyRollup.count <= 0
+        ).delete(synchronize_session=False)
+
+
+def _base_aggregates(user_id: Optional[int] = None):
+    month = cast(func.date_trunc("month", Expenses.date), Date)
+    stmt = (
+        select(Expenses.user_id, month, Expenses.category, Expenses.amount_type,
+               func.sum(Expenses.amount), func.count(Expenses.id))
+        .where(Expenses.date.isnot(None))
+        .group_by(Expenses.user_id, month, Expenses.category, Expenses.amount_type)
+    )
+    if user_id is not None:
+        stmt = stmt.where(Expenses.user_id == user_id)
+    return stmt
+
+
+def rebuild_rollup(db: Session, user_id: Optional[int] = None):
+    query = db.query(ExpenseMonthlyRollup)
+    if user_id is not None:
+        query = query.filter(ExpenseMonthlyRollup.user_id == user_id)
+    query.delete(synchronize_session=False)
+    R = ExpenseMonthlyRollup
+    db.execute(insert(R).from_select(
+        [R.user_id, R.month, R.category, R.amount_type, R.total, R.count], _base_aggregates(user_id)
+    ))
+
+
+def check_rollup(db: Session, user_id: Optional[int] = None, tolerance: float = 1e-6):
+    """Compare the rollup with expenses; returns a list of mismatching buckets."""
+    base = {tuple(row[:4]): (row[4], row[5]) for row in db.execute(_base_aggregates(user_id))}
+    R = ExpenseMonthlyRollup
+    query = db.query(R.user_id, R.month, R.category, R.amount_type, R.total, R.count)
+    if user_id is not None:
+        query = query.filter(R.user_id == user_id)
+    rollup = {tuple(row[:4]): (row[4], row[5]) for row in query}
+
+    mismatches = []
+    for key in base.keys() | rollup.keys():
+        expected, actual = base.get(key, (0.0, 0)), rollup.get(key, (0.0, 0))
+        if expected[1] != actual[1] or abs(expected[0] - actual[0]) > tolerance:
+            uid, month, category, kind = key
+            mismatches.append({
+                "user_id": uid, "month": str(month), "category": category, "amount_type": kind.value,
+                "expected": {"total": expected[0], "count": expected[1]},
+                "actual": {"total": actual[0], "count": actual[1]},
+            })
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the expense_monthly_rollup table.")
+    parser.add_argument("command", choices=["rebuild-rollup", "check-rollup"])
+    parser.add_argument("--user-id", type=int)
+    args = parser.parse_args()
+
+    with session_scope() as db:
+        if args.command == "rebuild-rollup":
+            ExpenseMonthlyRollup.__table__.create(bind=db.get_bind(), checkfirst=True)
+            rebuild_rollup(db, args.user_id)
+            db.commit()
+            print("Rollup rebuilt.")
+        else:
+            mismatches = check_rollup(db, args.user_id)
+            for m in mismatches:
+                print(m)
+            print(f"{len(mismatches)} mismatching bucket(s).")
+            raise SystemExit(1 if mismatches else 0)
@@ -5,10 +5,16 @@ from fastapi import HTTPException, status, Depends
 import os
 from dotenv import load_dotenv
 import redis # <-- NEW: Import Redis client
-import smtplib # Keep import if you use SMTP/TLS, but prefer API services
+from redis.commands.core import Script
+import queue
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from random import randint
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from cache import TTLCache
+from mailer import mail_queue
 # Assuming you install the 'requests' library (often needed for email APIs)
 # import requests 
 
@@ -17,14 +23,97 @@ algorithm = os.getenv("algorithm")
 secret_key = os.getenv("secret_key")
 redis_url = os.getenv("REDIS_URL") # <-- NEW: Read Redis URL
 
-# --- JWT and Password Hashing (No Change) ---
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+# --- JWT and Password Hashing ---
+# Raising BCRYPT_ROUNDS makes older hashes report needs_update, and they are rehashed on next login.
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=int(os.getenv("BCRYPT_ROUNDS", "12")))
+
+# bcrypt runs on a small dedicated pool; once workers + queue are full, callers get a fast 503.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "16"))
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", "10"))
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_LIMIT)
+hash_rejections = 0
+
+def _run_hashing(fn, *args):
+    global hash_rejections
+    if not _hash_slots.acquire(blocking=False):
+        hash_rejections += 1
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Server busy, please retry", headers={"Retry-After": "1"})
+    try:
+        future = _hash_pool.submit(fn, *args)
+    except Exception:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeout:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Server busy, please retry", headers={"Retry-After": "1"}) from None
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return _run_hashing(pwd_context.hash, password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return _run_hashing(pwd_context.verify, plain_password, hashed_password)
+
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Returns (valid, new_hash); new_hash is set when the stored hash should be replaced."""
+    return _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def hash_pool_stats() -> dict:
+    return {"workers": HASH_WORKERS, "queue_limit": HASH_QUEUE_LIMIT, "rejections": hash_rejections}
+
+# --- Auth caches: decoded tokens and known user ids ---
+token_cache = TTLCache(max_size=int(os.getenv("TOKEN_CACHE_SIZE", "10000")), ttl=3600)
+user_cache = TTLCache(max_size=int(os.getenv("USER_CACHE_SIZE", "10000")), ttl=float(os.getenv("USER_CACHE_TTL", "60")))
+USER_CACHE_REDIS = os.getenv("USER_CACHE_REDIS", "false").lower() == "true"
+redis_user_hits = 0
+
+def decode_access_token(token: str) -> dict:
+    """jwt.decode memoized per token until its exp; raises JWTError like jwt.decode."""
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, secret_key, algorithms=[algorithm])
+        ttl = payload.get("exp", 0) - time.time()
+        if ttl > 0:
+            token_cache.set(token, payload, ttl=ttl)
+    return payload
+
+def is_known_user(user_id: int) -> bool:
+    global redis_user_hits
+    if user_cache.get(user_id):
+        return True
+    if USER_CACHE_REDIS and r is not None:
+        try:
+            if r.exists(f"user:{user_id}"):
+                redis_user_hits += 1
+                user_cache.set(user_id, True)
+                return True
+        except redis.RedisError:
+            pass
+    return False
+
+def remember_user(user_id: int):
+    user_cache.set(user_id, True)
+    if USER_CACHE_REDIS and r is not None:
+        try:
+            r.setex(f"user:{user_id}", int(user_cache.ttl), 1)
+        except redis.RedisError:
+            pass
+
+def forget_user(user_id: int):
+    user_cache.pop(user_id)
+    if r is not None:
+        try:
+            r.delete(f"user:{user_id}")
+        except redis.RedisError:
+            pass
+
+def auth_cache_stats() -> dict:
+    return {"tokens": token_cache.stats(), "users": user_cache.stats(), "redis_user_hits": redis_user_hits}
 
 def create_access_token(user_id: int, expire_time: int = 30) -> str:
     expire = datetime.utcnow() + timedelta(minutes=expire_time)
@@ -36,43 +125,146 @@ def create_access_token(user_id: int, expire_time: int = 30) -> str:
     return token
 
 # --- Redis Configuration for OTP (Replaces otp_storage) ---
-# Connect to Redis using the REDIS_URL environment variable
+# The client connects on first command, so importing this module does no network I/O;
+# check_redis() is run from the app's startup instead of pinging here.
+r = None
 try:
     # Decode_responses=True makes it return strings instead of bytes
     r = redis.from_url(redis_url, decode_responses=True)
-    r.ping() # Check connection
-    print("Connected to Redis successfully!")
 except Exception as e:
-    print(f"Could not connect to Redis: {e}")
-    # In a real app, you might crash or use a fallback. 
-    # For now, we allow it to start for deployment testing.
+    print(f"Could not configure Redis: {e}")
+
+def check_redis() -> bool:
+    if r is None:
+        return False
+    try:
+        r.ping()
+        print("Connected to Redis successfully!")
+        return True
+    except Exception as e:
+        print(f"Could not connect to Redis: {e}")
+        # In a real app, you might crash or use a fallback.
+        # For now, we allow it to start for deployment testing.
+        return False
 
-def generate_otp(email:str, expire_minutes:int=5) -> int:
+# --- OTP issue/verify: one atomic Lua round-trip each, including rate limiting ---
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "600"))
+REGISTER_RATE_LIMIT = int(os.getenv("REGISTER_RATE_LIMIT", "5"))
+VERIFY_RATE_LIMIT = int(os.getenv("VERIFY_RATE_LIMIT", "10"))
+
+# Sliding window over sorted sets KEYS[3..n]; ARGV[3]=now_ms, ARGV[4]=window_ms, ARGV[5]=limit, ARGV[6]=member.
+_RATE_LIMIT_LUA = """
+local now = tonumber(ARGV[3])
+local window = tonumber(ARGV[4])
+for i = 3, #KEYS do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now - window)
+    if redis.call('ZCARD', KEYS[i]) >= tonumber(ARGV[5]) then
+        return -2
+    end
+end
+for i = 3, #KEYS do
+    redis.call('ZADD', KEYS[i], now, ARGV[6])
+    redis.call('PEXPIRE', KEYS[i], window)
+end
+"""
+
+# KEYS: otp, attempts, rate-limit keys...; ARGV[1]=otp, ARGV[2]=ttl_ms
+_issue_otp = Script(None, (_RATE_LIMIT_LUA + """
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+redis.call('DEL', KEYS[2])
+return 1
+""").encode())
+
+# KEYS: otp, attempts, rate-limit keys...; ARGV[1]=otp input, ARGV[2]=max attempts, ARGV[7]="1" to consume
+# Returns 1 ok (OTP consumed unless ARGV[7] is "0"), 0 missing/expired, -1 wrong, -2 rate limited.
+_consume_otp = Script(None, (_RATE_LIMIT_LUA + """
+local stored = redis.call('GET', KEYS[1])
+if not stored then
+    return 0
+end
+if stored == ARGV[1] then
+    if ARGV[7] == '1' then
+        redis.call('DEL', KEYS[1], KEYS[2])
+    end
+    return 1
+end
+local attempts = redis.call('INCR', KEYS[2])
+if attempts == 1 then
+    local ttl = redis.call('PTTL', KEYS[1])
+    if ttl > 0 then
+        redis.call('PEXPIRE', KEYS[2], ttl)
+    end
+end
+if attempts >= tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1], KEYS[2])
+end
+return -1
+""").encode())
+
+def _rate_limit_keys(action: str, email: str, client_ip: str | None) -> list:
+    keys = [f"rl:{action}:email:{email}"]
+    if client_ip:
+        keys.append(f"rl:{action}:ip:{client_ip}")
+    return keys
+
+def _rate_limit_args(limit: int) -> list:
+    now_ms = int(time.time() * 1000)
+    return [now_ms, RATE_LIMIT_WINDOW * 1000, limit, f"{now_ms}-{randint(0, 1_000_000)}"]
+
+def _too_many_requests():
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many attempts, try again later",
+                         headers={"Retry-After": str(RATE_LIMIT_WINDOW)})
+
+# KEYS: otp, attempts, rate-limit keys...; ARGV[1]=otp, ARGV[2]=rate-limit member. Undoes _issue_otp.
+_release_otp = Script(None, b"""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+for i = 3, #KEYS do
+    redis.call('ZREM', KEYS[i], ARGV[2])
+end
+return 1
+""")
+
+def generate_otp(email:str, expire_minutes:int=5, client_ip:str|None=None, deliver=None) -> int:
     otp = randint(100000, 999999) 
-    # Key in Redis: otp:<email>
-    redis_key = f"otp:{email}"
-    
-    # Store OTP with a time-to-live (TTL) in seconds
-    r.setex(redis_key, timedelta(minutes=expire_minutes), otp)
-    
+    # Key in Redis: otp:<email>, failed attempts in otp_attempts:<email>
+    keys = [f"otp:{email}", f"otp_attempts:{email}"] + _rate_limit_keys("register", email, client_ip)
+    rate_args = _rate_limit_args(REGISTER_RATE_LIMIT)
+    if _issue_otp(keys=keys, args=[otp, expire_minutes * 60 * 1000] + rate_args, client=r) == -2:
+        raise _too_many_requests()
+    if deliver is not None:
+        # If delivery fails (e.g. the mail queue is full) the OTP and its rate-limit slot are given back.
+        try:
+            deliver(otp)
+        except Exception:
+            _release_otp(keys=keys, args=[str(otp), rate_args[3]], client=r)
+            raise
     return otp
 
-def verify_otp(email:str, otp_input:int) -> bool:
-    redis_key = f"otp:{email}"
-    
-    # Get the OTP value (returns None if key doesn't exist or expired)
-    stored_otp = r.get(redis_key)
-    
-    if not stored_otp:
-        return False
-        
-    # Check if the stored OTP matches the input (stored_otp is a string)
-    if str(stored_otp) != str(otp_input):
-        return False
-        
-    # If successful, delete the key to prevent reuse
-    r.delete(redis_key)
-    return True
+def verify_otp(email:str, otp_input:int, client_ip:str|None=None, consume:bool=True) -> bool:
+    # Compare-and-delete happens inside Redis, so two concurrent verifies can't both succeed;
+    # the OTP is invalidated after OTP_MAX_ATTEMPTS wrong guesses. consume=False checks the OTP
+    # (rate limit and attempts included) but leaves it in place for take_otp.
+    keys = [f"otp:{email}", f"otp_attempts:{email}"] + _rate_limit_keys("verify", email, client_ip)
+    args = [str(otp_input), OTP_MAX_ATTEMPTS] + _rate_limit_args(VERIFY_RATE_LIMIT) + ["1" if consume else "0"]
+    result = _consume_otp(keys=keys, args=args, client=r)
+    if result == -2:
+        raise _too_many_requests()
+    return result == 1
+
+# KEYS: otp, attempts; ARGV[1]=otp. Compare-and-delete only, for an OTP already checked by verify_otp.
+_take_otp = Script(None, b"""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return 1
+end
+return 0
+""")
+
+def take_otp(email:str, otp_input:int) -> bool:
+    return _take_otp(keys=[f"otp:{email}", f"otp_attempts:{email}"], args=[str(otp_input)], client=r) == 1
     
 # --- Email Body (No Change) ---
 def otp_email_body(email: str, otp: int, expiry_minutes: int = 5):
@@ -101,7 +293,6 @@ def send_otp_email(to_email:str,otp:int):
 
     # If you must use SMTP, ensure you use a dedicated service account and secure credentials:
     send_email=os.getenv("SEND_EMAIL_USER") # Changed variable name
-    send_password=os.getenv("SEND_EMAIL_PASSWORD") # Changed variable name
     
     # If you use a service like SendGrid, the code would look like:
     # sendgrid_api_key = os.getenv("SENDGRID_API_KEY")
@@ -117,12 +308,10 @@ def send_otp_email(to_email:str,otp:int):
     msg['Subject']="Your OTP Code"
     msg.attach(MIMEText(body,'html'))
 
+    # Delivery happens on the background mail queue (persistent SMTP connection, retries);
+    # SMTP_HOST / SMTP_PORT / SMTP_SSL select the server, e.g. a local aiosmtpd for testing.
     try:
-        # Note: You may need to change 'smtp.gmail.com',465 to your chosen SMTP server
-        with smtplib.SMTP_SSL('smtp.gmail.com',465) as server:
-            server.login(send_email,send_password)
-            server.send_message(msg)
-    except Exception as e:
-        # Log the error, but don't crash the server
-        print(f"Failed to send email to {to_email}. Error: {e}")
-        # In a production app, you might raise an HTTPException here or log to a service
+        mail_queue.enqueue(msg)
+    except queue.Full:
+        print(f"Mail queue full, dropping OTP email to {to_email}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not send OTP, please retry")
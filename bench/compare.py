@@ -0,0 +1,57 @@
+"""Compare two bench.run reports.
+
+    python -m bench.compare base.json new.json [--threshold 10]
+
+Exits with status 1 when a profile's p95 latency grew, or its throughput dropped, by more than
+the threshold (percent).
+"""
+import argparse
+import json
+import sys
+
+
+def _change(old: float, new: float) -> float:
+    return (new - old) / old * 100 if old else 0.0
+
+
+def compare(base: dict, new: dict, threshold: float) -> list:
+    regressions = []
+    print(f"{'profile':<12}{'metric':<24}{'base':>12}{'new':>12}{'change':>10}")
+    for name in sorted(base["profiles"].keys() & new["profiles"].keys()):
+        old, cur = base["profiles"][name], new["profiles"][name]
+        rows = [
+            ("throughput_rps", old["throughput_rps"], cur["throughput_rps"], -1),
+            ("p50_ms", old["latency_ms"]["p50"], cur["latency_ms"]["p50"], 0),
+            ("p95_ms", old["latency_ms"]["p95"], cur["latency_ms"]["p95"], 1),
+            ("p99_ms", old["latency_ms"]["p99"], cur["latency_ms"]["p99"], 0),
+            ("db_queries_per_request", old["db_queries_per_request"], cur["db_queries_per_request"], 0),
+            ("rss_mb", old["rss_mb"], cur["rss_mb"], 0),
+        ]
+        for metric, a, b, direction in rows:
+            change = _change(a, b)
+            flag = ""
+            if direction and change * direction > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{name} {metric} {change:+.1f}%")
+            print(f"{name:<12}{metric:<24}{a:>12}{b:>12}{change:>+9.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports.")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args(argv)
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print("\nRegressions: " + "; ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
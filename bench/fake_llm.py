@@ -0,0 +1,80 @@
+import asyncio
+import re
+import time
+from uuid import uuid4
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+_USER_ID = re.compile(r"user_id=(\d+)")
+
+# One entry per user turn (cycled): the tool calls the fake model makes before answering.
+# "{user_id}" in an argument is replaced by the id found in the prompt.
+DEFAULT_SCRIPT = (
+    (("Fetch_Expenses", {}),),
+    (("Expense_Summary", {"summary": "categories"}),),
+    (("Execute_Safe_sql_Query", {"query": "SELECT category, sum(amount) AS total FROM expenses WHERE user_id = {user_id} GROUP BY category"}),),
+    (("Fetch_Expenses", {}), ("Expense_Summary", {"summary": "net"})),
+)
+
+
+def _fill(args: dict, user_id: int) -> dict:
+    return {
+        key: user_id if value == "{user_id}" else value.format(user_id=user_id) if isinstance(value, str) else value
+        for key, value in args.items()
+    }
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Deterministic stand-in for Gemini.
+
+    After a user message it issues the scripted tool calls for that turn; after tool results it
+    answers with a short text. `latency` (seconds) simulates model time per call.
+    """
+
+    script: tuple = DEFAULT_SCRIPT
+    latency: float = 0.0
+    answer_chars: int = 400
+    bound: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"bound": True})
+
+    def _respond(self, messages) -> ChatResult:
+        last = messages[-1]
+        if not self.bound:
+            message = AIMessage(content="Summary of the earlier conversation.")
+        elif isinstance(last, ToolMessage):
+            message = AIMessage(content=("Here is what I found. " * 40)[: self.answer_chars])
+        else:
+            prompt = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+            match = _USER_ID.search(str(prompt))
+            user_id = int(match.group(1)) if match else 0
+            turn = sum(isinstance(m, HumanMessage) for m in messages)
+            message = AIMessage(content="", tool_calls=[
+                {"name": name, "args": _fill(args, user_id), "id": f"call_{uuid4().hex[:12]}"}
+                for name, args in self.script[turn % len(self.script)]
+            ])
+        tokens = count_tokens_approximately(messages)
+        message.usage_metadata = {"input_tokens": tokens, "output_tokens": 20, "total_tokens": tokens + 20}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages)
+
+
+def scripted_factory(latency: float = 0.0):
+    """A chat model factory for agent.set_chat_model_factory."""
+    return lambda model, temperature: ScriptedChatModel(latency=latency)
@@ -0,0 +1,169 @@
+"""Partitioning benchmark: range queries and insert throughput per EXPENSES_PARTITIONING layout.
+
+    python -m bench.partitions --rows 50000000 --users 5000 --years 6 --modes none,range-year,range-month,hash:16
+
+For every layout a fresh database is seeded with the same rows, converted with
+partitioning.migrate_partitioning (timed, this is the migration path), and then exercised through
+the app's own query builders: listing pages, date-range analytics that hit the base table,
+id lookups for updates, and single-row and 50-row batch inserts.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.pg import LocalPostgres, ScratchDatabase  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_DAY = date(2024, 1, 1)  # bench.seed dates start here
+
+
+def _timed(fn, iterations: int) -> dict:
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {"p50_ms": round(statistics.median(samples), 3), "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3)}
+
+
+def child(args) -> dict:
+    from sqlalchemy import text
+    from analytics import category_breakdown, net_summary, period_totals
+    from bench.seed import seed_database
+    from bulk import create_expenses
+    from database import AddExpense, AmountType, Expenses, Granularity, get_engine, session_scope
+    from main import encode_cursor, expense_listing
+    from partitioning import migrate_partitioning
+
+    started = time.perf_counter()
+    users = [uid for uid, _ in seed_database(args.users, args.rows // args.users, days=args.years * 365)]
+    seed_s = time.perf_counter() - started
+    started = time.perf_counter()
+    migrate_partitioning(args.mode)
+    migrate_s = time.perf_counter() - started
+
+    engine = get_engine()
+    with engine.connect() as conn:
+        size = conn.execute(text("SELECT pg_total_relation_size(c.oid) FROM pg_class c WHERE relname = 'expenses'")).scalar()
+        size += conn.execute(text(
+            "SELECT coalesce(sum(pg_total_relation_size(inhrelid)), 0) FROM pg_inherits WHERE inhparent = 'expenses'::regclass"
+        )).scalar()
+        partitions = conn.execute(text("SELECT count(*) FROM pg_inherits WHERE inhparent = 'expenses'::regclass")).scalar()
+
+    rng = random.Random(42)
+    span = args.years * 365
+
+    def user(i):
+        return users[(i * 7919) % len(users)]
+
+    def window(days: int):
+        start = FIRST_DAY + timedelta(days=rng.randrange(0, span - days) + 3)  # off month boundaries: base-table path
+        return start, start + timedelta(days=days)
+
+    results = {}
+    with session_scope() as db:
+        sample = db.execute(text("SELECT id, user_id FROM expenses TABLESAMPLE SYSTEM (1) LIMIT 2000")).all()
+
+        results["list_first_page"] = _timed(lambda i: db.execute(expense_listing(user(i)).limit(50)).all(), args.queries)
+        results["list_deep_cursor"] = _timed(lambda i: db.execute(expense_listing(
+            user(i), encode_cursor(FIRST_DAY + timedelta(days=span // 3), 0)).limit(50)).all(), args.queries)
+        results["range_45d_daily_totals"] = _timed(lambda i: period_totals(
+            db, user(i), Granularity.DAY, *window(45)), args.queries)
+        results["range_45d_categories"] = _timed(lambda i: category_breakdown(db, user(i), *window(45)), args.queries)
+        results["range_1y_net"] = _timed(lambda i: net_summary(db, user(i), *window(365)), args.queries)
+        # The update/delete endpoints' lookup; identity-map hits are avoided by expunging.
+        def lookup(i):
+            row = sample[i % len(sample)]
+            db.query(Expenses).filter(Expenses.user_id == row.user_id, Expenses.id == row.id).first()
+            db.expunge_all()
+
+        results["lookup_by_id"] = _timed(lookup, args.queries)
+        db.rollback()
+
+        today = date.today()
+        started = time.perf_counter()
+        for i in range(args.inserts):
+            create_expenses(db, user(i), [AddExpense(category="bench", amount=1.0, amount_type=AmountType.DEBIT, date=today)])
+            db.commit()
+        single = args.inserts / (time.perf_counter() - started)
+        batch = [AddExpense(category="bench", amount=1.0, amount_type=AmountType.DEBIT,
+                            date=today - timedelta(days=k * 30)) for k in range(50)]
+        started = time.perf_counter()
+        for i in range(args.inserts // 50):
+            create_expenses(db, user(i), batch)
+            db.commit()
+        batched = (args.inserts // 50) * 50 / (time.perf_counter() - started)
+
+    return {
+        "mode": args.mode,
+        "partitions": partitions,
+        "seed_s": round(seed_s, 1),
+        "migrate_s": round(migrate_s, 1),
+        "size_mb": round(size / 2**20),
+        "queries": results,
+        "inserts_per_s": {"single_row": round(single), "batch_50": round(batched)},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark expenses partitioning layouts.")
+    parser.add_argument("--rows", type=int, default=50_000_000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--years", type=int, default=6)
+    parser.add_argument("--modes", default="none,range-year,range-month,hash:16")
+    parser.add_argument("--queries", type=int, default=300, help="iterations per query shape")
+    parser.add_argument("--inserts", type=int, default=2000, help="rows per insert test")
+    parser.add_argument("--postgres-uri", help="use a scratch database on this server instead of a private cluster")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args)))
+        return
+
+    reports = []
+    for mode in args.modes.split(","):
+        database = ScratchDatabase(args.postgres_uri) if args.postgres_uri else LocalPostgres()
+        uri = database.start()
+        env = {
+            **os.environ,
+            "POSTGRES_URI": uri,
+            "GEMINI_API_KEY": "bench",
+            "REDIS_URL": "redis://127.0.0.1:1/0",
+            "secret_key": os.getenv("secret_key", "bench-secret"),
+            "algorithm": os.getenv("algorithm", "HS256"),
+            "BCRYPT_ROUNDS": "4",
+        }
+        print(f"{mode}: seeding {args.rows} rows ...", file=sys.stderr)
+        try:
+            out = subprocess.run(
+                [sys.executable, "-m", "bench.partitions", "--child", "--mode", mode, "--rows", str(args.rows),
+                 "--users", str(args.users), "--years", str(args.years), "--queries", str(args.queries),
+                 "--inserts", str(args.inserts)],
+                cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            reports.append(json.loads(out.strip().splitlines()[-1]))
+        finally:
+            database.stop()
+
+    output = json.dumps({"rows": args.rows, "users": args.users, "years": args.years, "layouts": reports}, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
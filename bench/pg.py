@@ -0,0 +1,74 @@
+import os
+import pwd
+import shutil
+import subprocess
+import tempfile
+from urllib.parse import urlsplit, urlunsplit
+import psycopg
+
+# Throwaway Postgres for the benchmarks: either a private cluster started from the initdb/pg_ctl
+# binaries (PG_BIN or PATH) or a scratch database on an existing server (--postgres-uri).
+
+
+class LocalPostgres:
+    """A private cluster listening only on a unix socket in a temp dir; durability is switched off."""
+
+    def __init__(self, bin_dir: str = None, run_as: str = None):
+        self.bin_dir = bin_dir or os.getenv("PG_BIN")
+        # Postgres refuses to run as root; BENCH_PG_USER names the account to run it as.
+        self.run_as = run_as or os.getenv("BENCH_PG_USER") or ("postgres" if os.geteuid() == 0 else None)
+        self.root = None
+
+    def _binary(self, name: str) -> str:
+        path = os.path.join(self.bin_dir, name) if self.bin_dir else shutil.which(name)
+        if not path or not os.path.exists(path):
+            raise RuntimeError(f"{name} not found; set PG_BIN to the Postgres bin directory or pass --postgres-uri")
+        return path
+
+    def _run(self, *args):
+        command = list(args)
+        if os.geteuid() == 0:
+            command = ["runuser", "-u", self.run_as, "--", *command]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def start(self) -> str:
+        self.root = tempfile.mkdtemp(prefix="bench-pg-")
+        if os.geteuid() == 0:
+            account = pwd.getpwnam(self.run_as)
+            os.chown(self.root, account.pw_uid, account.pw_gid)
+        data = os.path.join(self.root, "data")
+        self._run(self._binary("initdb"), "-D", data, "-U", "postgres", "--auth=trust", "-E", "UTF8", "--no-sync")
+        options = f"-k {self.root} -c listen_addresses='' -c fsync=off -c synchronous_commit=off -c full_page_writes=off"
+        self._run(self._binary("pg_ctl"), "-D", data, "-o", options, "-l", os.path.join(self.root, "server.log"), "-w", "start")
+        return f"postgresql://postgres@/postgres?host={self.root}"
+
+    def stop(self):
+        if self.root is None:
+            return
+        try:
+            self._run(self._binary("pg_ctl"), "-D", os.path.join(self.root, "data"), "-m", "immediate", "stop")
+        finally:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+
+
+class ScratchDatabase:
+    """A fresh database on an existing server, dropped again on stop()."""
+
+    def __init__(self, server_uri: str):
+        self.server_uri = server_uri
+        self.name = f"bench_{os.getpid()}"
+
+    def _admin(self):
+        return psycopg.connect(self.server_uri, autocommit=True)
+
+    def start(self) -> str:
+        with self._admin() as conn:
+            conn.execute(f'DROP DATABASE IF EXISTS "{self.name}"')
+            conn.execute(f'CREATE DATABASE "{self.name}"')
+        parts = urlsplit(self.server_uri)
+        return urlunsplit(parts._replace(path=f"/{self.name}"))
+
+    def stop(self):
+        with self._admin() as conn:
+            conn.execute(f'DROP DATABASE IF EXISTS "{self.name}" WITH (FORCE)')
@@ -0,0 +1,191 @@
+"""Query-plan regression check.
+
+    python -m bench.plan_check [--users 20 --expenses 300] [--partitioning range-year] [--postgres-uri ...]
+
+Seeds a throwaway database, sends every API route (plus the fast path, the agent tools and the
+SQL tool through the scripted model) once, and records each SQL statement the app issues. Every
+distinct statement is then EXPLAINed with enable_seqscan off; a Seq Scan that survives that
+means no index can serve the query, and the check exits with status 1.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.pg import LocalPostgres, ScratchDatabase  # noqa: E402
+
+_EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+
+def _plan_nodes(node: dict):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from _plan_nodes(child)
+
+
+async def sweep(client, user: dict):
+    """One request per route and query shape."""
+    headers = user["headers"]
+    today = date.today()
+    month_start = today.replace(day=1)
+
+    async def call(method, url, **kwargs):
+        response = await client.request(method, url, headers=headers, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url} -> {response.status_code}: {response.text[:200]}")
+        return response
+
+    await client.post("/token", data={"username": user["email"], "password": user["password"]})
+    await call("POST", "/addexpense", json={"category": "plan", "amount": 10, "amount_type": "debit", "date": today.isoformat()})
+    page = await call("GET", "/getexpense?limit=5")
+    await call("GET", f"/getexpense?limit=5&cursor={page.headers['X-Next-Cursor']}")
+    await call("GET", "/getexpense?limit=5&category=plan")
+    await call("GET", f"/getexpense?limit=5&amount_type=credit&start={(today - timedelta(days=90)).isoformat()}&end={today.isoformat()}")
+    await call("GET", "/getexpense?stream=true&category=food")
+    target = (await call("GET", "/getexpense?limit=1&category=plan")).json()[0]["id"]
+    await call("POST", f"/update_expense/{target}", json={"amount": 11})
+    added = (await call("POST", "/batch/addexpense", json={"items": [
+        {"category": "plan", "amount": 1, "amount_type": "debit", "date": today.isoformat()},
+        {"category": "plan", "amount": 2, "amount_type": "credit", "date": today.isoformat()},
+    ]})).json()
+    await call("POST", "/batch/update_expense", json={"items": [{"id": added[0]["id"], "amount": 3}]})
+    await call("DELETE", "/multiple_items", json={"items": [added[1]["id"]]})
+    await call("DELETE", f"/delete_expense/{target}")
+    await call("POST", "/import_expenses?format=csv",
+               files={"file": ("e.csv", f"category,amount,amount_type,date\nplan,5,debit,{today.isoformat()}\n")})
+    await call("GET", f"/export_expenses?start={(today - timedelta(days=365)).isoformat()}")
+    await call("GET", "/summary/totals")
+    await call("GET", f"/summary/totals?granularity=day&start={(today - timedelta(days=45)).isoformat()}&category=food")
+    await call("GET", "/summary/categories")
+    await call("GET", f"/summary/categories?granularity=week&amount_type=debit&start={(month_start - timedelta(days=10)).isoformat()}")
+    await call("GET", "/summary/net")
+    await call("GET", f"/summary/net?start={(today - timedelta(days=40)).isoformat()}&category=food")
+    for query in ("show my last expenses", "how much did I spend this month", "add 120 for food today", "yes",
+                  "which category is the largest?", "what about travel?", "run a query", "compare debit and credit"):
+        await call("POST", "/chat", json={"query": query})
+
+
+def agent_tool_sweep(user_id: int):
+    """The write tools the scripted model never calls."""
+    import agent
+    from database import Expenses, session_scope
+
+    with session_scope() as db:
+        record_id = db.query(Expenses.id).filter(Expenses.user_id == user_id).order_by(Expenses.id.desc()).first().id
+    agent.update_record(user_id, record_id, amount=7.0, confirmation=True)
+    agent.delete_record(user_id, record_id, confirmation=True)
+
+
+def explain_all(engine, statements: dict) -> list:
+    failures = []
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("SET enable_seqscan = off")
+        for statement, parameters in statements.items():
+            try:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+                plan = cursor.fetchone()[0][0]["Plan"]
+            except Exception as e:
+                raw.rollback()
+                cursor.execute("SET enable_seqscan = off")
+                failures.append({"statement": statement, "error": str(e).strip()})
+                continue
+            raw.rollback()  # EXPLAIN doesn't execute, but keep every statement in a fresh transaction
+            cursor.execute("SET enable_seqscan = off")
+            nodes = list(_plan_nodes(plan))
+            seq_scans = sorted({n.get("Relation Name", "?") for n in nodes if n["Node Type"] == "Seq Scan"})
+            indexes = sorted({n["Index Name"] for n in nodes if "Index Name" in n})
+            status = "SEQ SCAN " + ",".join(seq_scans) if seq_scans else "ok"
+            print(f"{status:<28} {','.join(indexes) or '-':<60} {' '.join(statement.split())[:110]}")
+            if seq_scans:
+                failures.append({"statement": statement, "seq_scans": seq_scans})
+    finally:
+        raw.close()
+    return failures
+
+
+async def check(args) -> list:
+    import httpx
+    import authorization
+    import agent
+    import main
+    from bench.fake_llm import scripted_factory
+    from bench.seed import BENCH_PASSWORD, seed_database
+    from database import get_engine
+    from sqlalchemy import event
+
+    import fakeredis
+    authorization.r = fakeredis.FakeRedis(decode_responses=True)
+    agent.set_chat_model_factory(scripted_factory())
+
+    [(user_id, email), *_] = seed_database(args.users, args.expenses, days=args.days)
+    if args.partitioning:
+        from partitioning import migrate_partitioning
+        migrate_partitioning(args.partitioning)
+    await agent.setup_checkpointer()
+    user = {"id": user_id, "email": email, "password": BENCH_PASSWORD,
+            "headers": {"Authorization": f"Bearer {authorization.create_access_token(user_id, expire_time=60)}"}}
+
+    engine = get_engine()
+    statements = {}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].lower().startswith(_EXPLAINABLE):
+            if executemany:
+                parameters = parameters[0]
+            statements.setdefault(statement, parameters)
+
+    app = main.app
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            await sweep(client, user)
+            await asyncio.to_thread(agent_tool_sweep, user_id)
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        print(f"{len(statements)} distinct statements captured", file=sys.stderr)
+        return explain_all(engine, statements)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail when an app query can only be served by a sequential scan.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--expenses", type=int, default=300, help="expenses per user")
+    parser.add_argument("--days", type=int, default=730, help="spread of expense dates")
+    parser.add_argument("--partitioning", help="EXPENSES_PARTITIONING layout to check, e.g. range-year or hash:8")
+    parser.add_argument("--postgres-uri", help="use a scratch database on this server instead of a private cluster")
+    args = parser.parse_args(argv)
+
+    database = ScratchDatabase(args.postgres_uri) if args.postgres_uri else LocalPostgres()
+    uri = database.start()
+    os.environ.update({
+        "POSTGRES_URI": uri,
+        "GEMINI_API_KEY": "bench",
+        "REDIS_URL": "redis://127.0.0.1:1/0",  # replaced by fakeredis after import
+        "secret_key": os.getenv("secret_key", "bench-secret"),
+        "algorithm": os.getenv("algorithm", "HS256"),
+        "BCRYPT_ROUNDS": "4",
+        "RESPONSE_CACHE_ENABLED": "false",  # every chat turn should reach the agent or the fast path
+    })
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            failures = asyncio.run(check(args))
+    finally:
+        database.stop()
+
+    if failures:
+        print(json.dumps(failures, indent=2, default=str))
+        sys.exit(1)
+    print("No sequential scans.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Offline benchmark harness.
+
+    python -m bench.run --users 20 --expenses 1000 --profiles login,crud,getexpense,chat --out bench.json
+
+main.app is driven in-process through httpx's ASGI transport against local stand-ins: a throwaway
+Postgres (initdb/pg_ctl from PG_BIN or PATH, or a scratch database via --postgres-uri), fakeredis
+and a scripted chat model injected with agent.set_chat_model_factory. The JSON output is stable
+across runs; compare two with `python -m bench.compare old.json new.json`.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.pg import LocalPostgres, ScratchDatabase  # noqa: E402
+
+PROFILES = ("login", "crud", "getexpense", "chat")
+CHAT_QUERIES = (
+    "show my last expenses",
+    "which category did I spend the most on?",
+    "how much did I spend this month",
+    "compare my debit and credit totals",
+    "what did I spend on travel recently?",
+    "add 120 for food today",
+    "yes",
+    "give me a breakdown of my spending by category",
+)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def _latency_summary(latencies: list) -> dict:
+    ms = [x * 1000 for x in latencies]
+    return {
+        "p50": round(percentile(ms, 50), 3),
+        "p95": round(percentile(ms, 95), 3),
+        "p99": round(percentile(ms, 99), 3),
+        "mean": round(statistics.fmean(ms), 3) if ms else 0.0,
+        "max": round(max(ms), 3) if ms else 0.0,
+    }
+
+
+class Recorder:
+    """Times every request of a profile, overall and per route."""
+
+    def __init__(self, client):
+        self.client = client
+        self.latencies = []
+        self.routes = defaultdict(list)
+        self.errors = Counter()
+
+    async def request(self, route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - started
+        self.latencies.append(elapsed)
+        self.routes[route].append(elapsed)
+        if response.status_code >= 400:
+            self.errors[f"{route} {response.status_code}"] += 1
+        return response
+
+
+# --- Load profiles: each runs one iteration for the given user ---
+
+async def login_profile(rec: Recorder, user, state):
+    await rec.request("/token", "POST", "/token", data={"username": user["email"], "password": state["password"]})
+
+
+async def crud_profile(rec: Recorder, user, state):
+    headers = user["headers"]
+    added = await rec.request("/addexpense", "POST", "/addexpense", headers=headers,
+                              json={"category": "bench", "amount": 42.5, "amount_type": "debit", "date": date.today().isoformat()})
+    await rec.request("/getexpense", "GET", "/getexpense?limit=20", headers=headers)
+    page = await rec.request("/getexpense", "GET", "/getexpense?limit=1&category=bench", headers=headers)
+    if added.status_code >= 400 or page.status_code >= 400 or not page.json():
+        return
+    expense_id = page.json()[0]["id"]
+    await rec.request("/update_expense/{id}", "POST", f"/update_expense/{expense_id}", headers=headers, json={"amount": 43.0})
+    await rec.request("/delete_expense/{id}", "DELETE", f"/delete_expense/{expense_id}", headers=headers)
+
+
+async def getexpense_profile(rec: Recorder, user, state):
+    url = "/getexpense?limit=50"
+    for _ in range(state["pages"]):
+        response = await rec.request("/getexpense", "GET", url, headers=user["headers"])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        url = f"/getexpense?limit=50&cursor={cursor}"
+
+
+async def chat_turn(rec: Recorder, user, turn: int):
+    query = CHAT_QUERIES[turn % len(CHAT_QUERIES)]
+    response = await rec.request("/chat", "POST", "/chat", headers=user["headers"], json={"query": query})
+    if response.status_code < 400:
+        rec.routes[f"/chat [{response.json().get('route', 'agent').split(':')[0]}]"].append(rec.latencies[-1])
+
+
+async def run_profile(name: str, client, users: list, args, state: dict, engine) -> dict:
+    from sqlalchemy import event
+
+    rec = Recorder(client)
+    statements = 0
+
+    def count_statement(*_):
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine, "after_cursor_execute", count_statement)
+    started = time.perf_counter()
+    try:
+        if name == "chat":
+            # Turns of one conversation are sequential; conversations run concurrently.
+            chat_users = users[: args.chat_users]
+
+            async def conversation(worker: int):
+                for user in chat_users[worker::args.concurrency]:
+                    for turn in range(args.chat_turns):
+                        await chat_turn(rec, user, turn)
+
+            await asyncio.gather(*(conversation(k) for k in range(args.concurrency)))
+        else:
+            profile = {"login": login_profile, "crud": crud_profile, "getexpense": getexpense_profile}[name]
+            iterations = args.login_requests if name == "login" else args.requests
+            counter = itertools.count()
+
+            async def worker():
+                while (i := next(counter)) < iterations:
+                    await profile(rec, users[i % len(users)], state)
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    finally:
+        duration = time.perf_counter() - started
+        event.remove(engine, "after_cursor_execute", count_statement)
+
+    requests = len(rec.latencies)
+    return {
+        "requests": requests,
+        "errors": dict(rec.errors),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(requests / duration, 2) if duration else 0.0,
+        "latency_ms": _latency_summary(rec.latencies),
+        "routes": {route: {"count": len(values), **_latency_summary(values)} for route, values in sorted(rec.routes.items())},
+        "db_queries_per_request": round(statements / requests, 2) if requests else 0.0,
+        "rss_mb": round(rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args) -> dict:
+    # Application modules read their configuration at import time, so import them only now.
+    import httpx
+    import authorization
+    import agent
+    import main
+    from bench.fake_llm import scripted_factory
+    from bench.seed import BENCH_PASSWORD, seed_database
+    from database import get_engine
+
+    try:
+        import fakeredis
+        authorization.r = fakeredis.FakeRedis(decode_responses=True)
+    except ImportError:
+        print("fakeredis is not installed; running without Redis")
+        authorization.r = None
+    agent.set_chat_model_factory(scripted_factory(args.llm_latency))
+
+    seeded = time.perf_counter()
+    users = [
+        {"id": user_id, "email": email,
+         "headers": {"Authorization": f"Bearer {authorization.create_access_token(user_id, expire_time=24 * 60)}"}}
+        for user_id, email in seed_database(args.users, args.expenses, seed=args.seed)
+    ]
+    seed_seconds = time.perf_counter() - seeded
+    state = {"password": BENCH_PASSWORD, "pages": args.pages}
+
+    await agent.setup_checkpointer()
+    engine = get_engine()
+
+    results = {}
+    app = main.app
+    transport = httpx.ASGITransport(app=app)  # does not send lifespan events, so run the lifespan here
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name in args.profiles:
+            print(f"running {name} ...", file=sys.stderr)
+            results[name] = await run_profile(name, client, users, args, state, engine)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed_seconds": round(seed_seconds, 2),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "postgres_uri")},
+        },
+        "profiles": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load benchmarks for the expense API.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--expenses", type=int, default=1000, help="expenses per user")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help=f"comma-separated subset of {PROFILES}")
+    parser.add_argument("--requests", type=int, default=200, help="iterations for crud/getexpense")
+    parser.add_argument("--login-requests", type=int, default=40, help="logins (each one is a bcrypt verify)")
+    parser.add_argument("--pages", type=int, default=3, help="/getexpense pages followed per iteration")
+    parser.add_argument("--chat-users", type=int, default=4)
+    parser.add_argument("--chat-turns", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per model call")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seed", type=float, default=0.42)
+    parser.add_argument("--bcrypt-rounds", type=int, default=None, help="override BCRYPT_ROUNDS for the run")
+    parser.add_argument("--postgres-uri", help="use a scratch database on this server instead of a private cluster")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+    args.profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    unknown = set(args.profiles) - set(PROFILES)
+    if unknown:
+        parser.error(f"unknown profiles: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    database = ScratchDatabase(args.postgres_uri) if args.postgres_uri else LocalPostgres()
+    uri = database.start()
+    os.environ.update({
+        "POSTGRES_URI": uri,
+        "GEMINI_API_KEY": "bench",
+        "REDIS_URL": "redis://127.0.0.1:1/0",  # replaced by fakeredis after import
+        "secret_key": os.getenv("secret_key", "bench-secret"),
+        "algorithm": os.getenv("algorithm", "HS256"),
+    })
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):  # keep the app's print logging out of the JSON
+            report = asyncio.run(benchmark(args))
+    finally:
+        database.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+from sqlalchemy import text
+from analytics import rebuild_rollup
+from authorization import hash_password
+from database import User, get_engine, session_scope
+from manage import migrate_schema
+
+CATEGORIES = ("food", "travel", "rent", "salary", "fun", "health")
+BENCH_PASSWORD = "bench-password"
+
+
+def seed_database(users: int, expenses_per_user: int, seed: float = 0.42, days: int = 730):
+    """Create the schema and N users x M expenses over `days` days (deterministic for a given seed); returns [(id, email)]."""
+    migrate_schema()
+    password = hash_password(BENCH_PASSWORD)  # one bcrypt hash shared by every bench user
+    with session_scope() as db:
+        db.execute(text("SELECT setseed(:seed)"), {"seed": seed})
+        db.execute(
+            text("""
+                INSERT INTO users (email, password, created_at)
+                SELECT 'bench' || g || '@example.com', :password, now() FROM generate_series(1, :users) g
+            """),
+            {"password": password, "users": users},
+        )
+        db.execute(
+            text("""
+                INSERT INTO expenses (user_id, category, amount, amount_type, date, created_at)
+                SELECT u.id,
+                       (:categories)[1 + (g % :n_categories)],
+                       round((random() * 500)::numeric, 2),
+                       CASE WHEN g % :n_categories = 3 THEN 'CREDIT' ELSE 'DEBIT' END,
+                       date '2024-01-01' + (g % :days),
+                       now()
+                FROM users u CROSS JOIN generate_series(1, :per_user) g
+                WHERE u.email LIKE 'bench%@example.com'
+            """),
+            {"categories": list(CATEGORIES), "n_categories": len(CATEGORIES), "per_user": expenses_per_user,
+             "days": days},
+        )
+        rebuild_rollup(db)
+        db.commit()
+        rows = db.query(User.id, User.email).filter(User.email.like("bench%@example.com")).order_by(User.id).all()
+    with get_engine().connect() as conn:
+        conn.execute(text("ANALYZE"))
+        conn.commit()
+    return [(row.id, row.email) for row in rows]
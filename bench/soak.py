@@ -0,0 +1,144 @@
+"""Connection soak test for the agent tools.
+
+    python -m bench.soak [--calls 10000 --concurrency 8] [--postgres-uri ...]
+
+Seeds a throwaway database and runs the agent's tool functions the way the tool node does
+(the async coroutines, several at once, each with its own ToolRuntime context), cycling through
+reads, SQL, confirmed and unconfirmed writes and failing calls. Every `--sample-every` calls the
+server's connection count (pg_stat_activity) and the pool's checked-out count are recorded.
+Exits with status 1 if connections exceed DB_POOL_SIZE + DB_MAX_OVERFLOW, grow between the first
+and last quarter of the run, or are still checked out at the end, or if any call raised (a leaked
+session shows up as pool timeouts).
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.pg import LocalPostgres, ScratchDatabase  # noqa: E402
+
+
+def tool_calls(agent, runtime, record_ids: list):
+    """One round of tool calls; cycled for the whole run."""
+    user_id = runtime.context["user_id"]
+    records = itertools.cycle(record_ids)
+    return itertools.cycle((
+        lambda: agent.afetch_own_expenses(runtime),
+        lambda: agent.aown_expense_summary(runtime, "categories"),
+        lambda: agent.aown_expense_summary(runtime, "totals", "day", "2024-01-01", "2024-03-01"),
+        lambda: agent.aown_expense_summary(runtime, "net"),
+        lambda: agent.asafe_sql_query(
+            f"SELECT category, sum(amount) FROM expenses WHERE user_id = {user_id} GROUP BY category", runtime),
+        lambda: agent.asafe_sql_query(
+            f"SELECT amount / 0 FROM expenses WHERE user_id = {user_id}", runtime),  # fails in Postgres
+        lambda: agent.asafe_sql_query("SELECT * FROM users", runtime),  # rejected by the guard
+        lambda: agent.aupdate_own_record(runtime, next(records), amount=12.5),  # unconfirmed: rolled back
+        lambda: agent.aupdate_own_record(runtime, next(records), amount=13.5, confirmation=True),
+        lambda: agent.adelete_own_record(runtime, next(records)),  # unconfirmed
+        lambda: agent.aupdate_own_record(runtime, -1, amount=1, confirmation=True),  # no such record
+    ))
+
+
+def server_connections(uri: str) -> int:
+    import psycopg
+
+    with psycopg.connect(uri, autocommit=True) as conn:
+        return conn.execute(
+            "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()"
+        ).fetchone()[0]
+
+
+async def soak(args, uri: str) -> dict:
+    import agent
+    import authorization
+    import fakeredis
+    from langchain.tools import ToolRuntime
+    from bench.seed import seed_database
+    from database import Expenses, get_engine, session_scope
+
+    authorization.r = fakeredis.FakeRedis(decode_responses=True)
+    users = seed_database(args.users, 100)
+    with session_scope() as db:
+        ids = {uid: [row.id for row in db.query(Expenses.id).filter(Expenses.user_id == uid).limit(20)] for uid, _ in users}
+
+    streams = [
+        tool_calls(agent, ToolRuntime(state=None, context={"user_id": uid}, config={}, stream_writer=None,
+                                      tool_call_id=None, store=None), ids[uid])
+        for uid, _ in users
+    ]
+    pool = get_engine().pool
+    samples = []
+    errors = 0
+    done = 0
+    started = time.perf_counter()
+    while done < args.calls:
+        batch = [next(streams[(done + i) % len(streams)])() for i in range(min(args.concurrency, args.calls - done))]
+        errors += sum(isinstance(r, Exception) for r in await asyncio.gather(*batch, return_exceptions=True))
+        done += len(batch)
+        if done % args.sample_every < len(batch) or done == args.calls:
+            samples.append({"calls": done, "server": server_connections(uri), "checked_out": pool.checkedout()})
+
+    quarter = max(len(samples) // 4, 1)
+    return {
+        "calls": args.calls,
+        "concurrency": args.concurrency,
+        "seconds": round(time.perf_counter() - started, 1),
+        "exceptions": errors,
+        "pool_limit": int(os.getenv("DB_POOL_SIZE", "5")) + int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "server_connections": {
+            "first_quarter_max": max(s["server"] for s in samples[:quarter]),
+            "last_quarter_max": max(s["server"] for s in samples[-quarter:]),
+            "max": max(s["server"] for s in samples),
+        },
+        "checked_out_at_end": samples[-1]["checked_out"],
+        "samples": samples,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that agent tool calls don't leak pooled connections.")
+    parser.add_argument("--calls", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--sample-every", type=int, default=250, help="calls between connection samples")
+    parser.add_argument("--postgres-uri", help="use a scratch database on this server instead of a private cluster")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    database = ScratchDatabase(args.postgres_uri) if args.postgres_uri else LocalPostgres()
+    uri = database.start()
+    os.environ.update({
+        "POSTGRES_URI": uri,
+        "GEMINI_API_KEY": "bench",
+        "REDIS_URL": "redis://127.0.0.1:1/0",  # replaced by fakeredis after import
+        "secret_key": os.getenv("secret_key", "bench-secret"),
+        "algorithm": os.getenv("algorithm", "HS256"),
+        "BCRYPT_ROUNDS": "4",
+    })
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            report = asyncio.run(soak(args, uri))
+    finally:
+        database.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    connections = report["server_connections"]
+    if (connections["max"] > report["pool_limit"] or connections["last_quarter_max"] > connections["first_quarter_max"]
+            or report["checked_out_at_end"] or report["exceptions"]):
+        print("Connection count is not flat.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Cold-start benchmark.
+
+    python -m bench.startup --runs 5 --out startup.json
+
+Each run is a fresh interpreter that imports main, runs the app's lifespan startup and then
+sends a first /getexpense and two /chat requests (scripted model, see bench.fake_llm). Under
+gunicorn --preload the import happens once in the master, so a forked worker is ready after
+`startup_s`; without it every worker pays `import_s + startup_s`.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.pg import LocalPostgres, ScratchDatabase  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHAT_QUERIES = ("which category did I spend the most on?", "give me a breakdown of my spending by category")
+
+
+async def _first_requests(app, headers: dict) -> dict:
+    import httpx
+
+    timings = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            timings["startup_s"] = time.perf_counter() - started
+            for name, method, url, body in (
+                ("first_request_ms", "GET", "/getexpense?limit=20", None),
+                ("first_chat_ms", "POST", "/chat", {"query": CHAT_QUERIES[0]}),
+                ("second_chat_ms", "POST", "/chat", {"query": CHAT_QUERIES[1]}),
+            ):
+                started = time.perf_counter()
+                response = await client.request(method, url, headers=headers, json=body)
+                response.raise_for_status()
+                timings[name] = (time.perf_counter() - started) * 1000
+    return timings
+
+
+def child(token: str, llm_latency: float) -> dict:
+    started = time.perf_counter()
+    import main
+    app = main.app
+    import_s = time.perf_counter() - started
+
+    import agent
+    import authorization
+    import fakeredis
+    from bench.fake_llm import scripted_factory
+    authorization.r = fakeredis.FakeRedis(decode_responses=True)
+    agent.set_chat_model_factory(scripted_factory(llm_latency))
+
+    with contextlib.redirect_stdout(sys.stderr):
+        timings = asyncio.run(_first_requests(app, {"Authorization": f"Bearer {token}"}))
+    return {"import_s": import_s, **timings, "ready_s": import_s + timings["startup_s"]}
+
+
+def _summary(runs: list) -> dict:
+    return {
+        key: {"median": round(statistics.median(r[key] for r in runs), 4), "min": round(min(r[key] for r in runs), 4)}
+        for key in runs[0]
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure worker cold start and first-request latency.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--postgres-uri", help="use a scratch database on this server instead of a private cluster")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--token", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.token, args.llm_latency)))
+        return
+
+    database = ScratchDatabase(args.postgres_uri) if args.postgres_uri else LocalPostgres()
+    uri = database.start()
+    env = {
+        **os.environ,
+        "POSTGRES_URI": uri,
+        "GEMINI_API_KEY": "bench",
+        "REDIS_URL": "redis://127.0.0.1:1/0",  # replaced by fakeredis in the child
+        "secret_key": os.getenv("secret_key", "bench-secret"),
+        "algorithm": os.getenv("algorithm", "HS256"),
+        "BCRYPT_ROUNDS": "4",
+    }
+    try:
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "manage.py", "migrate"], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+        migrate_s = time.perf_counter() - started
+
+        # Seed one user in a throwaway interpreter so this process stays free of app imports.
+        seed = (
+            "import json; from bench.seed import seed_database; from authorization import create_access_token; "
+            "[(uid, _)] = seed_database(1, 200); print(json.dumps(create_access_token(uid, expire_time=60)))"
+        )
+        token = json.loads(subprocess.run([sys.executable, "-c", seed], cwd=ROOT, env=env, check=True,
+                                          capture_output=True, text=True).stdout.strip().splitlines()[-1])
+        runs = []
+        for _ in range(args.runs):
+            out = subprocess.run(
+                [sys.executable, "-m", "bench.startup", "--child", "--token", token, "--llm-latency", str(args.llm_latency)],
+                cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+    finally:
+        database.stop()
+
+    report = {"migrate_s": round(migrate_s, 3), "runs": len(runs), "timings": _summary(runs)}
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
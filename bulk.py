@@ -0,0 +1,231 @@
+import csv
+import io
+import json
+import os
+from itertools import islice
+import psycopg
+from pydantic import ValidationError
+from sqlalchemy import Date, Float, Integer, String, cast, column, func, insert, select, update, values
+from sqlalchemy.orm import Session
+from database import AddExpense, ExpensePatch, Expenses, session_scope
+from analytics import apply_rollup
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+COPY_EXPENSES = "COPY expenses (user_id, category, amount, amount_type, date) FROM STDIN"
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+EXPORT_COLUMNS = ("id", "category", "amount", "amount_type", "date", "created_at")
+
+
+# --- Import ---
+
+def iter_upload(fileobj, fmt: str):
+    """Yield (row_number, payload) pairs; payload is an exception when the line can't be decoded."""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        for number, row in enumerate(csv.DictReader(text), start=1):
+            yield number, {k.strip(): (v if v != "" else None) for k, v in row.items() if k}
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, e
+
+
+def _copy_chunk(db: Session, user_id: int, expenses: list[AddExpense]):
+    raw = db.connection().connection.driver_connection
+    if isinstance(raw, psycopg.Connection):
+        with raw.cursor() as cur, cur.copy(COPY_EXPENSES) as copy:
+            for e in expenses:
+                # amount_type is a non-native Enum column, stored by member name
+                copy.write_row((user_id, e.category, e.amount, e.amount_type.name, e.date))
+    else:
+        db.execute(insert(Expenses), [
+            {"user_id": user_id, "category": e.category, "amount": e.amount, "amount_type": e.amount_type, "date": e.date}
+            for e in expenses
+        ])
+
+
+def import_expenses(db: Session, user_id: int, fileobj, fmt: str, chunk_size: int = IMPORT_CHUNK_SIZE):
+    rows = iter_upload(fileobj, fmt)
+    inserted, failed, errors = 0, 0, []
+
+    def report(number, detail):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"row": number, "errors": detail})
+
+    while chunk := list(islice(rows, chunk_size)):
+        valid = []
+        for number, payload in chunk:
+            if isinstance(payload, Exception):
+                report(number, [{"msg": str(payload)}])
+                continue
+            try:
+                valid.append((number, AddExpense.model_validate(payload)))
+            except ValidationError as e:
+                report(number, e.errors(include_url=False, include_context=False))
+        if not valid:
+            continue
+
+        # One transaction per chunk: COPY + rollup deltas commit together.
+        expenses = [e for _, e in valid]
+        try:
+            _copy_chunk(db, user_id, expenses)
+            apply_rollup(db, user_id, added=[(e.date, e.category, e.amount_type, e.amount) for e in expenses])
+            db.commit()
+            inserted += len(expenses)
+        except Exception as e:
+            db.rollback()
+            for number, _ in valid:
+                report(number, [{"msg": f"chunk rejected by the database: {e}"}])
+
+    return {"inserted": inserted, "failed": failed, "errors": errors}
+
+
+# --- Batch create / update ---
+
+_RETURNED = (Expenses.id, Expenses.category, Expenses.amount, Expenses.amount_type, Expenses.date)
+
+
+def create_expenses(db: Session, user_id: int, items: list[AddExpense]):
+    """Insert all items with one INSERT ... VALUES ... RETURNING (caller commits)."""
+    if not items:
+        return []
+    rows = db.execute(
+        insert(Expenses)
+        .values([
+            {"user_id": user_id, "category": e.category, "amount": e.amount, "amount_type": e.amount_type, "date": e.date}
+            for e in items
+        ])
+        .returning(*_RETURNED)
+    ).all()
+    apply_rollup(db, user_id, added=[(r.date, r.category, r.amount_type, r.amount) for r in rows])
+    return rows
+
+
+def patch_expenses(db: Session, user_id: int, items: list[ExpensePatch]):
+    """Apply partial updates with one UPDATE ... FROM (VALUES ...); None fields are left unchanged (caller commits)."""
+    patches = {p.id: p for p in items}  # last patch for an id wins
+    if not patches:
+        return [], []
+
+    # Old values are needed for the rollup deltas; FOR UPDATE keeps them stable until commit.
+    before = db.execute(
+        select(*_RETURNED).where(Expenses.user_id == user_id, Expenses.id.in_(patches)).with_for_update()
+    ).all()
+
+    patch = values(
+        column("id", Integer), column("category", String), column("amount", Float),
+        column("amount_type", String), column("date", Date),
+        name="patch",
+    ).data([
+        (p.id, p.category, p.amount, p.amount_type.name if p.amount_type else None, p.date)
+        for p in patches.values()
+    ])
+    rows = db.execute(
+        update(Expenses)
+        .where(Expenses.id == patch.c.id, Expenses.user_id == user_id)
+        .values(
+            category=func.coalesce(cast(patch.c.category, String), Expenses.category),
+            amount=func.coalesce(cast(patch.c.amount, Float), Expenses.amount),
+            amount_type=func.coalesce(cast(patch.c.amount_type, String), Expenses.amount_type),
+            date=func.coalesce(cast(patch.c.date, Date), Expenses.date),
+        )
+        .returning(*_RETURNED)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    apply_rollup(
+        db, user_id,
+        added=[(r.date, r.category, r.amount_type, r.amount) for r in rows],
+        removed=[(r.date, r.category, r.amount_type, r.amount) for r in before],
+    )
+    found = {r.id for r in rows}
+    return rows, [i for i in patches if i not in found]
+
+
+# --- Export ---
+
+def _export_batches(user_id: int, start=None, end=None, batch_size: int = EXPORT_BATCH_SIZE):
+    stmt = (
+        select(Expenses.id, Expenses.category, Expenses.amount, Expenses.amount_type, Expenses.date, Expenses.created_at)
+        .where(Expenses.user_id == user_id)
+        .order_by(Expenses.date, Expenses.id)
+    )
+    if start:
+        stmt = stmt.where(Expenses.date >= start)
+    if end:
+        stmt = stmt.where(Expenses.date <= end)
+    with session_scope() as db:
+        # yield_per streams from a server-side cursor, so only one batch is held at a time
+        result = db.execute(stmt.execution_options(yield_per=batch_size))
+        for rows in result.partitions():
+            yield rows
+
+
+def export_csv(user_id: int, start=None, end=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for rows in _export_batches(user_id, start, end):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows((r.id, r.category, r.amount, r.amount_type.value, r.date, r.created_at) for r in rows)
+        yield buffer.getvalue()
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only file that hands out what was written so far; tell() keeps the absolute offset Parquet needs."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def export_parquet(user_id: int, start=None, end=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()), ("category", pa.string()), ("amount", pa.float64()),
+        ("amount_type", pa.string()), ("date", pa.date32()), ("created_at", pa.timestamp("us")),
+    ])
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in _export_batches(user_id, start, end):
+            writer.write_table(pa.Table.from_pydict({
+                "id": [r.id for r in rows],
+                "category": [r.category for r in rows],
+                "amount": [r.amount for r in rows],
+                "amount_type": [r.amount_type.value for r in rows],
+                "date": [r.date for r in rows],
+                "created_at": [r.created_at for r in rows],
+            }, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
@@ -1,24 +1,73 @@
-from sqlalchemy import create_engine, Column, String, Enum, Integer, TIMESTAMP, Index, Float, DateTime, ForeignKey, Date, Text, func
+from sqlalchemy import create_engine, Column, String, Enum, Integer, TIMESTAMP, Index, Float, DateTime, ForeignKey, Date, Text, func, text
+from contextlib import contextmanager
 from datetime import datetime, date
+import datetime as dt
 from typing import Optional, List
 from pydantic import BaseModel, EmailStr
 import enum
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 import os
+import threading
 from dotenv import load_dotenv
 load_dotenv()
 
 database_url = os.getenv("POSTGRES_URI")
-engine = create_engine(database_url)
-session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+# The engine is created on first use, i.e. inside the worker process; with gunicorn --preload the
+# master only imports this module, so no pooled connection is ever shared across a fork.
+_engine = None
+_engine_lock = threading.Lock()
+session = sessionmaker(autoflush=False, autocommit=False)
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(
+                    database_url,
+                    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+                    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+                    pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+                    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+                )
+                session.configure(bind=_engine)
+    return _engine
+
+def dispose_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+
+def __getattr__(name):
+    # `from database import engine` keeps working and creates the engine at that point.
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module 'database' has no attribute {name!r}")
 
 def get_db():
+    get_engine()
     db = session()
     try:
         yield db
     finally:
         db.close()
 
+@contextmanager
+def session_scope():
+    """Session for code outside a request (agent tools, scripts); callers commit explicitly."""
+    get_engine()
+    db = session()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
 Base = declarative_base()
 
 
@@ -36,9 +85,22 @@ class AmountType(enum.Enum):
     DEBIT = "debit"
     CREDIT = "credit"
 
+class Granularity(enum.Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
 class Expenses(Base):
     __tablename__ = "expenses"
-    __table_args__ = (Index("idx_user_date", "user_id", "date"),)
+    # Created on existing databases by `python manage.py migrate` (CONCURRENTLY); see manage.OBSOLETE_INDEXES.
+    __table_args__ = (
+        # Listing newest first (/getexpense, Fetch_Expenses, exports) as an index-only scan.
+        Index("idx_expenses_user_date_id", "user_id", text("date DESC"), text("id DESC"),
+              postgresql_include=["category", "amount", "amount_type"]),
+        # Category filters on the listing and the per-category analytics.
+        Index("idx_expenses_user_category_date", "user_id", "category", "date", "id",
+              postgresql_include=["amount", "amount_type"]),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -50,8 +112,19 @@ class Expenses(Base):
 
     user = relationship("User", back_populates="expenses")
 
+class ExpenseMonthlyRollup(Base):
+    __tablename__ = "expense_monthly_rollup"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    month = Column(Date, primary_key=True)
+    category = Column(String, primary_key=True)
+    amount_type = Column(Enum(AmountType, native_enum=False), primary_key=True)
+    total = Column(Float, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
 class Messages(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (Index("idx_chat_messages_user_created", "user_id", "created_at"),)
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     role = Column(String, nullable=False)
@@ -86,7 +159,44 @@ class ExpenseOut(BaseModel):
 class update_expenses(BaseModel):
     category: Optional[str] = None
     amount: Optional[float] = None
-    date: Optional[date] = None
+    date: Optional[dt.date] = None  # dt.date: the field name shadows `date` in the class body
+
+class ExpensePatch(BaseModel):
+    id: int
+    category: Optional[str] = None
+    amount: Optional[float] = None
+    amount_type: Optional[AmountType] = None
+    date: Optional[dt.date] = None
+
+class Batch_AddExpense(BaseModel):
+    items: List[AddExpense]
+
+class Batch_UpdateExpense(BaseModel):
+    items: List[ExpensePatch]
+
+class BatchUpdateResult(BaseModel):
+    updated: List[ExpenseOut]
+    not_found: List[int]
+
+class PeriodTotal(BaseModel):
+    period: date
+    debit: float
+    credit: float
+    net: float
+    count: int
+
+class CategoryTotal(BaseModel):
+    period: Optional[date] = None
+    category: str
+    amount_type: AmountType
+    total: float
+    count: int
+
+class NetSummary(BaseModel):
+    debit: float
+    credit: float
+    net: float
+    count: int
 
 class chat(BaseModel):
     query: str
@@ -0,0 +1,170 @@
+import json
+import re
+from collections import Counter
+from datetime import date, timedelta
+import redis
+from agent import fetch_expenses
+from analytics import apply_rollup, net_summary, rollup_row
+import authorization
+from cache import TTLCache
+from database import AmountType, Expenses, session_scope
+
+# Deterministic pre-agent router: common intents are answered straight from the
+# database; anything that doesn't match falls through to the agent.
+
+_LIST = re.compile(r"^(?:show|list|display|get|view|see)(?: me)?(?: my)?(?: last| latest| recent)?(?: (?P<count>\d+))? (?:expenses|transactions|records|spending)$")
+_TOTAL = re.compile(
+    r"^(?:what(?:'s| is) my )?(?:total(?: spending| spent| expenses)?|how much (?:did|have) i (?:spend|spent)|how much i spent)"
+    r"(?: on (?P<category>[a-z][a-z ]*?))? (?P<period>today|yesterday|this week|this month|last month|this year)$"
+)
+_ADD = re.compile(
+    r"^(?P<verb>add|spent|paid|earned|received)(?: rs\.?| ₹| \$)? ?(?P<amount>\d+(?:\.\d+)?)(?: rs| rupees| dollars)?"
+    r" (?:for|on|from) (?P<category>[a-z][a-z ]*?)(?: (?P<when>today|yesterday|on \d{4}-\d{2}-\d{2}))?$"
+)
+_YES = {"yes", "y", "yes please", "confirm", "ok", "okay", "sure"}
+_NO = {"no", "n", "nope", "cancel"}
+_CREDIT_VERBS = {"earned", "received"}
+
+LIST_MAX = 50  # largest "show my last N expenses" answered on the fast path
+PENDING_TTL = 300
+_pending = TTLCache(max_size=10000, ttl=PENDING_TTL)  # used when Redis is unavailable
+route_counts = Counter()
+
+
+def normalize(query: str) -> str:
+    return re.sub(r"\s+", " ", query.strip().lower()).rstrip("?.! ")
+
+
+def _period_range(period: str, today: date):
+    if period == "today":
+        return today, today
+    if period == "yesterday":
+        day = today - timedelta(days=1)
+        return day, day
+    if period == "this week":
+        return today - timedelta(days=today.weekday()), today
+    if period == "this month":
+        return today.replace(day=1), today
+    if period == "last month":
+        end = today.replace(day=1) - timedelta(days=1)
+        return end.replace(day=1), end
+    return today.replace(month=1, day=1), today  # "so far": future-dated entries aren't counted, like "this week"
+
+
+# --- Pending insert confirmations (shared across workers through Redis when available) ---
+
+def _save_pending(user_id: int, pending: dict):
+    if authorization.r is not None:
+        try:
+            authorization.r.setex(f"pending_add:{user_id}", PENDING_TTL, json.dumps(pending))
+            return
+        except redis.RedisError:
+            pass
+    _pending.set(user_id, pending)
+
+
+def _pop_pending(user_id: int):
+    if authorization.r is not None:
+        try:
+            raw = authorization.r.getdel(f"pending_add:{user_id}")
+            if raw:
+                return json.loads(raw)
+        except redis.RedisError:
+            pass
+    return _pending.pop(user_id)
+
+
+# --- Intent handlers ---
+
+def _list_expenses(user_id: int, match) -> str:
+    limit = min(max(int(match["count"]), 1), LIST_MAX) if match["count"] else 10
+    rows = fetch_expenses(user_id, limit)
+    if isinstance(rows, str):
+        return rows
+    lines = [f"{i}. ID: {e['id']} | Category: {e['category']} | Amount: {e['amount']} | Date: {e['date']}"
+             for i, e in enumerate(rows, start=1)]
+    return "Here are your most recent expenses:\n" + "\n".join(lines)
+
+
+def _totals(user_id: int, match) -> str:
+    period, category = match["period"], match["category"]
+    start, end = _period_range(period, date.today())
+    with session_scope() as db:
+        summary = net_summary(db, user_id, start, end, category)
+    scope = f" on {category}" if category else ""
+    return (f"{period.capitalize()}{scope} you spent {summary['debit']:.2f} and received {summary['credit']:.2f} "
+            f"(net {summary['net']:.2f}) across {summary['count']} record(s).")
+
+
+def _propose_add(user_id: int, match) -> str:
+    when = match["when"] or "today"
+    if when == "today":
+        day = date.today()
+    elif when == "yesterday":
+        day = date.today() - timedelta(days=1)
+    else:
+        given = when.removeprefix("on ")
+        try:
+            day = date.fromisoformat(given)
+        except ValueError:
+            return f"{given} is not a valid date. Please give the date as YYYY-MM-DD."
+    kind = AmountType.CREDIT if match["verb"] in _CREDIT_VERBS else AmountType.DEBIT
+    pending = {"category": match["category"], "amount": float(match["amount"]), "amount_type": kind.value, "date": day.isoformat()}
+    _save_pending(user_id, pending)
+    return (f"You want to add {pending['amount']:.2f} for {pending['category']} on {pending['date']} "
+            f"as {kind.value.upper()}. Do you confirm? (yes/no)")
+
+
+def _confirm_add(user_id: int, pending: dict) -> str:
+    from response_cache import bump_data_version
+
+    record = Expenses(
+        user_id=user_id,
+        category=pending["category"],
+        amount=pending["amount"],
+        amount_type=AmountType(pending["amount_type"]),
+        date=date.fromisoformat(pending["date"]),
+    )
+    with session_scope() as db:
+        db.add(record)
+        apply_rollup(db, user_id, added=[rollup_row(record)])
+        db.commit()
+    bump_data_version(user_id)
+    return f"✅ Added {pending['amount']:.2f} for {pending['category']} on {pending['date']}."
+
+
+_INTENTS = (
+    ("list_expenses", _LIST, _list_expenses),
+    ("totals", _TOTAL, _totals),
+    ("add_expense", _ADD, _propose_add),
+)
+
+
+def route_query(user_id: int, query: str):
+    """Answer recognised intents directly; returns None when the agent should handle the query."""
+    text = normalize(query)
+
+    # A pending add only survives until the next message; anything but yes/no discards it.
+    pending = _pop_pending(user_id)
+    if pending is not None and text in _YES:
+        route_counts["fast_path:confirm_add"] += 1
+        return {"response": _confirm_add(user_id, pending), "route": "fast_path:confirm_add"}
+    if pending is not None and text in _NO:
+        route_counts["fast_path:cancel_add"] += 1
+        return {"response": "Cancelled. No changes were made.", "route": "fast_path:cancel_add"}
+
+    for name, pattern, handler in _INTENTS:
+        match = pattern.match(text)
+        if match:
+            route = f"fast_path:{name}"
+            route_counts[route] += 1
+            return {"response": handler(user_id, match), "route": route}
+
+    route_counts["agent"] += 1
+    return None
+
+
+def router_stats() -> dict:
+    total = sum(route_counts.values())
+    fast = total - route_counts["agent"]
+    return {"routes": dict(route_counts), "fast_path_ratio": round(fast / total, 4) if total else 0.0}
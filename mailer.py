@@ -0,0 +1,129 @@
+import os
+import queue
+import smtplib
+import threading
+import time
+from dotenv import load_dotenv
+load_dotenv()
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "true").lower() == "true"
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "false").lower() == "true"
+SMTP_USER = os.getenv("SEND_EMAIL_USER")
+SMTP_PASSWORD = os.getenv("SEND_EMAIL_PASSWORD")
+
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "1000"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "4"))
+MAIL_RETRY_BACKOFF = float(os.getenv("MAIL_RETRY_BACKOFF", "1"))
+MAIL_IDLE_TIMEOUT = float(os.getenv("MAIL_IDLE_TIMEOUT", "60"))
+
+
+class MailQueue:
+    """In-process delivery queue drained by one background thread over a persistent SMTP connection."""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=MAIL_QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._server = None
+        self.metrics = {"enqueued": 0, "sent": 0, "failed": 0, "retries": 0, "connects": 0, "batches": 0}
+
+    def enqueue(self, message):
+        """Queue a message for delivery; raises queue.Full when the backlog is at MAIL_QUEUE_SIZE."""
+        self._ensure_worker()
+        self._queue.put_nowait(message)
+        self.metrics["enqueued"] += 1
+
+    def stop(self, timeout: float = 10):
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+        self._disconnect()
+
+    def stats(self) -> dict:
+        return {**self.metrics, "queued": self._queue.qsize()}
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="mail-queue", daemon=True)
+                self._thread.start()
+
+    def _connect(self):
+        if SMTP_SSL:
+            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=30)
+        else:
+            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+            if SMTP_STARTTLS:
+                server.starttls()
+        if SMTP_USER:
+            server.login(SMTP_USER, SMTP_PASSWORD)
+        self.metrics["connects"] += 1
+        return server
+
+    def _disconnect(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    def _ensure_connection(self):
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] == 250:
+                    return
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._disconnect()
+        self._server = self._connect()
+
+    def _run(self):
+        while True:
+            try:
+                message = self._queue.get(timeout=MAIL_IDLE_TIMEOUT)
+            except queue.Empty:
+                self._disconnect()  # don't hold an idle connection open
+                continue
+            if message is None:
+                return
+            batch = [message]
+            while len(batch) < MAIL_BATCH_SIZE:
+                try:
+                    message = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if message is None:
+                    self._send_batch(batch)
+                    return
+                batch.append(message)
+            self._send_batch(batch)
+
+    def _send_batch(self, batch):
+        self.metrics["batches"] += 1
+        try:
+            self._ensure_connection()  # one NOOP health check per batch
+        except (smtplib.SMTPException, OSError):
+            self._disconnect()
+        for message in batch:
+            for attempt in range(MAIL_MAX_ATTEMPTS):
+                try:
+                    if self._server is None:
+                        self._server = self._connect()
+                    self._server.send_message(message)
+                    self.metrics["sent"] += 1
+                    break
+                except (smtplib.SMTPException, OSError) as e:
+                    self._disconnect()
+                    if attempt + 1 == MAIL_MAX_ATTEMPTS:
+                        self.metrics["failed"] += 1
+                        print(f"Failed to send email to {message['To']}. Error: {e}")
+                    else:
+                        self.metrics["retries"] += 1
+                        time.sleep(MAIL_RETRY_BACKOFF * 2 ** attempt)
+
+
+mail_queue = MailQueue()
@@ -1,13 +1,32 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, status, BackgroundTasks, Query, Request, Response, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import and_,or_
-from langchain_core.messages import HumanMessage
-from jose import JWTError,jwt
-from database import get_db, User, Expenses, UserCreate,chat, AddExpense, ExpenseOut, Base, engine,update_expenses,Messages,Delete_Multiple,RegisterStep1,RegisterStep2
-from authorization import hash_password, verify_password, create_access_token,secret_key,algorithm,generate_otp,send_otp_email,verify_otp
+from sqlalchemy import and_,or_,delete,select,event
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from jose import JWTError
+from database import get_db, session_scope, User, Expenses, UserCreate,chat, AddExpense, ExpenseOut, get_engine, dispose_engine,update_expenses,Messages,Delete_Multiple,RegisterStep1,RegisterStep2,Granularity,AmountType,PeriodTotal,CategoryTotal,NetSummary,Batch_AddExpense,Batch_UpdateExpense,BatchUpdateResult
+from analytics import period_totals, category_breakdown, net_summary, apply_rollup, rollup_row
+from mailer import mail_queue
+from response_cache import RESPONSE_CACHE_ENABLED, get_cached_response, record_turn, bump_data_version, turn_tool_calls, response_cache_stats
+from agent import agent_registry, get_agent, build_prompt, last_reply, append_turn, ensure_checkpointer, close_checkpointer, setup_checkpointer, prune_checkpoints, log_turn_usage
+from intent_router import route_query, router_stats
+from manage import migrate_schema
+from partitioning import PARTITIONING, ensure_future_partitions
+from sql_guard import validated_statements
+from metrics import MetricsMiddleware, instrument_engine, metrics_callbacks, metrics_payload, register_stats, METRICS_ENABLED
+from bulk import import_expenses, export_csv, export_parquet, create_expenses, patch_expenses, BATCH_MAX_ITEMS
+from authorization import check_redis,hash_pool_stats,auth_cache_stats,hash_password, verify_and_update_password, create_access_token,generate_otp,send_otp_email,verify_otp,take_otp,decode_access_token,is_known_user,remember_user,forget_user
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 import os # <-- Important: import os
+import asyncio
+import time
+from contextlib import asynccontextmanager
+import json
+import base64
+import importlib.util
+from datetime import date
+from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 load_dotenv()
@@ -18,71 +37,120 @@ cors_origin_env = os.getenv("CORS_ORIGIN", "*")
 orging = [o.strip() for o in cors_origin_env.split(',')]
 # --- FIX END ---
 
-Base.metadata.create_all(bind=engine)
+# Schema and checkpoint tables come from `python manage.py migrate`; AUTO_MIGRATE=true runs it at startup (local dev).
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
+# Open the checkpoint pool and compile the agent before the worker takes traffic, so the first /chat doesn't pay for it.
+WARM_START = os.getenv("WARM_START", "true").lower() == "true"
 
 oauth_scheme = OAuth2PasswordBearer(tokenUrl="token")
-app = FastAPI(title="Expense Tracker")
+router = APIRouter()
 
+register_stats("auth_cache", auth_cache_stats)
+register_stats("hash_pool", hash_pool_stats)
+register_stats("mail_queue", mail_queue.stats)
+register_stats("response_cache", response_cache_stats)
+register_stats("router", router_stats)
+register_stats("agent_registry", agent_registry.stats)
+register_stats("sql_guard_cache", validated_statements.stats)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=orging, # Now uses the configured environment variable list
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in each worker after the fork; with --preload the master has only imported the code.
+    if AUTO_MIGRATE:
+        await asyncio.to_thread(migrate_schema)
+        await setup_checkpointer()
+    instrument_engine(get_engine())
+    asyncio.get_running_loop().run_in_executor(None, check_redis)  # log only, don't hold up startup
+    if PARTITIONING.startswith("range"):
+        asyncio.get_running_loop().run_in_executor(None, ensure_future_partitions)
+    if WARM_START:
+        await ensure_checkpointer()
+        get_agent()
+    yield
+    await close_checkpointer()
+    mail_queue.stop()
+    dispose_engine()
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
 
 
 def get_current_user(token: str = Depends(oauth_scheme), db: Session = Depends(get_db)):
     try:
-        payload = jwt.decode(token, secret_key, algorithms=[algorithm])
+        payload = decode_access_token(token)
         user_id: int = payload.get("sub")
         if not user_id:
             raise HTTPException(status_code=401, detail="Unauthorized")
-    except JWTError:
+        user_id = int(user_id)
+    except (JWTError, ValueError):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    user = db.query(User).filter(User.id == user_id).first()
+    if is_known_user(user_id):
+        return user_id
+
+    user = db.query(User.id).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
+    remember_user(user.id)
     return user.id
 
-@app.post("/token")
+@event.listens_for(User, "after_delete")
+def _forget_deleted_user(mapper, connection, target):
+    forget_user(target.id)
+
+@router.post("/token")
 def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     email = form.username   
     password = form.password
 
     user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.password):
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid Credentials")
+    valid, new_hash = verify_and_update_password(password, user.password)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid Credentials")
+    if new_hash:
+        user.password = new_hash
+        db.commit()
 
     token = create_access_token(user.id)
     return {"access_token": token, "token_type": "bearer"}
 
 
-@app.post("/register")
-def register_send_otp(data: RegisterStep1, db: Session = Depends(get_db)):
+@router.post("/register")
+def register_send_otp(data: RegisterStep1, request: Request, db: Session = Depends(get_db)):
     existing_user = db.query(User).filter(User.email == data.email).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    otp = generate_otp(data.email)
-    send_otp_email(data.email, otp)
+    generate_otp(data.email, client_ip=request.client.host if request.client else None,
+                 deliver=lambda otp: send_otp_email(data.email, otp))
     return {"message": f"OTP sent to {data.email}. It expires in 5 minutes."}
 
 
-@app.post("/register/verify")
-def verify_and_register(data: RegisterStep2, db: Session = Depends(get_db)):
-    if not verify_otp(data.email, data.otp):
+@router.post("/register/verify")
+def verify_and_register(data: RegisterStep2, request: Request, db: Session = Depends(get_db)):
+    # Rate limit and OTP check come first, so junk OTPs never reach the bcrypt pool; the OTP is only
+    # consumed after hashing, so a busy pool (503) doesn't cost the user their code.
+    if not verify_otp(data.email, data.otp, client_ip=request.client.host if request.client else None, consume=False):
         raise HTTPException(status_code=400, detail="Invalid or expired OTP")
-    
- 
+
     existing_user = db.query(User).filter(User.email == data.email).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="User already registered")
-    
-    new_user = User(email=data.email, password=hash_password(data.password))
+
+    password_hash = hash_password(data.password)
+    if not take_otp(data.email, data.otp):  # a concurrent verify won
+        raise HTTPException(status_code=400, detail="Invalid or expired OTP")
+
+    new_user = User(email=data.email, password=password_hash)
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
@@ -90,7 +158,7 @@ def verify_and_register(data: RegisterStep2, db: Session = Depends(get_db)):
     return {"message": "Registration complete!", "email": new_user.email}
 
 
-@app.post("/addexpense", response_model=AddExpense)
+@router.post("/addexpense", response_model=AddExpense)
 def add_expense(expense: AddExpense, db: Session = Depends(get_db), userid: int = Depends(get_current_user)):
     record = Expenses(
         user_id=userid,
@@ -100,54 +168,160 @@ def add_expense(expense: AddExpense, db: Session = Depends(get_db), userid: int
         date=expense.date
     )
     db.add(record)
+    apply_rollup(db, userid, added=[rollup_row(record)])
     db.commit()
+    bump_data_version(userid)
     db.refresh(record)
     return record
 
 
-@app.get("/getexpense", response_model=list[ExpenseOut])
-def retriew_expense(userid: int = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(Expenses).filter(Expenses.user_id == userid).all()
+def encode_cursor(row_date: Optional[date], row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{row_date or ''}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        raw_date, raw_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return (date.fromisoformat(raw_date) if raw_date else None), int(raw_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def expense_listing(user_id: int, cursor: Optional[str] = None, category: Optional[str] = None, amount_type: Optional[AmountType] = None, start: Optional[date] = None, end: Optional[date] = None):
+    # Newest first on (date, id); DESC puts NULL dates first, matching idx_expenses_user_date_id.
+    stmt = (
+        select(Expenses.id, Expenses.category, Expenses.amount, Expenses.date)
+        .where(Expenses.user_id == user_id)
+        .order_by(Expenses.date.desc(), Expenses.id.desc())
+    )
+    if category:
+        stmt = stmt.where(Expenses.category == category)
+    if amount_type:
+        stmt = stmt.where(Expenses.amount_type == amount_type)
+    if start:
+        stmt = stmt.where(Expenses.date >= start)
+    if end:
+        stmt = stmt.where(Expenses.date <= end)
+    if cursor:
+        after_date, after_id = decode_cursor(cursor)
+        if after_date is None:
+            stmt = stmt.where(or_(and_(Expenses.date.is_(None), Expenses.id < after_id), Expenses.date.isnot(None)))
+        else:
+            stmt = stmt.where(or_(Expenses.date < after_date, and_(Expenses.date == after_date, Expenses.id < after_id)))
+    return stmt
+
+def stream_expenses(stmt, batch_size: int = 1000):
+    with session_scope() as db:
+        result = db.execute(stmt.execution_options(yield_per=batch_size))
+        for rows in result.partitions():
+            yield "".join(
+                json.dumps({"id": r.id, "category": r.category, "amount": r.amount, "date": r.date}, default=str) + "\n"
+                for r in rows
+            )
 
-@app.post("/update_expense/{expense_id}",response_model=update_expenses)
+@router.get("/getexpense", response_model=list[ExpenseOut])
+def retriew_expense(response: Response, limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None, category: Optional[str] = None, amount_type: Optional[AmountType] = None, start: Optional[date] = None, end: Optional[date] = None, stream: bool = False, userid: int = Depends(get_current_user), db: Session = Depends(get_db)):
+    stmt = expense_listing(userid, cursor, category, amount_type, start, end)
+    if limit:
+        stmt = stmt.limit(limit)
+    if stream:
+        return StreamingResponse(stream_expenses(stmt), media_type="application/x-ndjson")
+
+    rows = db.execute(stmt).all()
+    if limit and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].date, rows[-1].id)
+    return [{"id": r.id, "category": r.category, "amount": r.amount, "date": r.date} for r in rows]
+
+@router.post("/update_expense/{expense_id}",response_model=update_expenses)
 def update_expense(data:update_expenses,expense_id:int,user_id:int=Depends(get_current_user),db:Session=Depends(get_db)):
-    record=db.query(Expenses).filter(and_(Expenses.user_id==user_id,Expenses.id==expense_id)).first()
+    record=db.query(Expenses).filter(and_(Expenses.user_id==user_id,Expenses.id==expense_id)).with_for_update().first()  # row lock: the rollup delta is taken from these values
     if not record:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    before=rollup_row(record)
     update_data=data.dict(exclude_unset=True)
     for key,value in update_data.items():
         setattr(record,key,value)
+    apply_rollup(db,user_id,added=[rollup_row(record)],removed=[before])
     db.commit()
+    bump_data_version(user_id)
     db.refresh(record)
     return record
-@app.delete("/delete_expense/{expense_id}")
+@router.delete("/delete_expense/{expense_id}")
 def delete_expense(expense_id:int,user_id:int=Depends(get_current_user),db:Session=Depends(get_db)):
-    record=db.query(Expenses).filter(and_(Expenses.user_id==user_id,Expenses.id==expense_id)).first()
+    record=db.query(Expenses).filter(and_(Expenses.user_id==user_id,Expenses.id==expense_id)).with_for_update().first()
     if not record:
         raise HTTPException(status_code=404,detail="Expense not found")
     db.delete(record)
+    apply_rollup(db,user_id,removed=[rollup_row(record)])
     db.commit()
+    bump_data_version(user_id)
     return {"Message":"Expense Deleted "}
 
-@app.delete("/multiple_items")
+@router.delete("/multiple_items")
 def delete_multiple_items(data:Delete_Multiple,user_id:int=Depends(get_current_user),db:Session=Depends(get_db)):
-    deleted=db.query(Expenses).filter(Expenses.user_id==user_id,Expenses.id.in_(data.items)).delete(synchronize_session=False)
+    deleted=db.execute(
+        delete(Expenses)
+        .where(Expenses.user_id==user_id,Expenses.id.in_(data.items))
+        .returning(Expenses.date,Expenses.category,Expenses.amount_type,Expenses.amount)
+        .execution_options(synchronize_session=False)
+    ).all()
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="Record with Ids not found")
+    apply_rollup(db,user_id,removed=deleted)
     db.commit()
+    bump_data_version(user_id)
     return "Successfully delete the Records"
 
-    
-@app.post("/chat")
-async def Aichat(req: chat, user_id: int = Depends(get_current_user)):
-    from agent import get_agent, build_prompt
+@router.post("/batch/addexpense", response_model=list[ExpenseOut])
+def add_expense_batch(data: Batch_AddExpense, user_id: int = Depends(get_current_user), db: Session = Depends(get_db)):
+    if len(data.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    rows = create_expenses(db, user_id, data.items)
+    db.commit()
+    bump_data_version(user_id)
+    return [{"id": r.id, "category": r.category, "amount": r.amount, "date": r.date} for r in rows]
 
-    prompt = build_prompt(user_id, req.query)
-    agent = get_agent(user_id)
-    result = agent.invoke(
-        {"messages": [HumanMessage(content=prompt)]},
-        config={"configurable": {"thread_id": user_id}} # <--- thread_id GOES HERE
-    )
+@router.post("/batch/update_expense", response_model=BatchUpdateResult)
+def update_expense_batch(data: Batch_UpdateExpense, user_id: int = Depends(get_current_user), db: Session = Depends(get_db)):
+    if len(data.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    rows, not_found = patch_expenses(db, user_id, data.items)
+    db.commit()
+    if rows:
+        bump_data_version(user_id)
+    return {"updated": [{"id": r.id, "category": r.category, "amount": r.amount, "date": r.date} for r in rows], "not_found": not_found}
+
+@router.post("/import_expenses")
+def import_expense_file(file: UploadFile = File(...), format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"), user_id: int = Depends(get_current_user), db: Session = Depends(get_db)):
+    fmt = format or ("ndjson" if (file.filename or "").endswith((".ndjson", ".jsonl")) else "csv")
+    result = import_expenses(db, user_id, file.file, fmt)
+    if result["inserted"]:
+        bump_data_version(user_id)
+    return result
+
+@router.get("/export_expenses")
+def export_expense_file(format: str = Query("csv", pattern="^(csv|parquet)$"), start: Optional[date] = None, end: Optional[date] = None, user_id: int = Depends(get_current_user)):
+    if format == "parquet":
+        if importlib.util.find_spec("pyarrow") is None:
+            raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+        return StreamingResponse(export_parquet(user_id, start, end), media_type="application/vnd.apache.parquet",
+                                 headers={"Content-Disposition": 'attachment; filename="expenses.parquet"'})
+    return StreamingResponse(export_csv(user_id, start, end), media_type="text/csv",
+                             headers={"Content-Disposition": 'attachment; filename="expenses.csv"'})
+
+
+@router.get("/summary/totals", response_model=list[PeriodTotal])
+def summary_totals(granularity: Granularity = Granularity.MONTH, start: Optional[date] = None, end: Optional[date] = None, category: Optional[str] = None, user_id: int = Depends(get_current_user), db: Session = Depends(get_db)):
+    return period_totals(db, user_id, granularity, start, end, category)
+
+@router.get("/summary/categories", response_model=list[CategoryTotal])
+def summary_categories(start: Optional[date] = None, end: Optional[date] = None, granularity: Optional[Granularity] = None, amount_type: Optional[AmountType] = None, user_id: int = Depends(get_current_user), db: Session = Depends(get_db)):
+    return category_breakdown(db, user_id, start, end, granularity, amount_type)
+
+@router.get("/summary/net", response_model=NetSummary)
+def summary_net(start: Optional[date] = None, end: Optional[date] = None, category: Optional[str] = None, user_id: int = Depends(get_current_user), db: Session = Depends(get_db)):
+    return net_summary(db, user_id, start, end, category)
+
+    
+def format_agent_response(result):
     if isinstance(result, dict) and 'messages' in result:
     
         final_message = result['messages'][-1]
@@ -164,3 +338,145 @@ async def Aichat(req: chat, user_id: int = Depends(get_current_user)):
         return {"response": result["output"]}
         
     return {"response": f"An unknown error occurred. Raw output structure mismatch."}
+
+
+def chunk_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return ""
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def sse_answer(payload: dict) -> StreamingResponse:
+    """Stream an answer that was produced without running the agent."""
+    async def events():
+        yield sse_event("token", {"text": payload["response"]})
+        yield sse_event("final", payload)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/chat")
+async def Aichat(req: chat, background_tasks: BackgroundTasks, user_id: int = Depends(get_current_user)):
+    fast = await asyncio.to_thread(route_query, user_id, req.query)
+    await ensure_checkpointer()
+    prompt = build_prompt(user_id, req.query)
+    if fast is not None:
+        await append_turn(user_id, prompt, fast["response"])  # keep the agent's thread aware of fast-path turns
+        return fast
+    reply = await last_reply(user_id) if RESPONSE_CACHE_ENABLED else ""
+    cached, cache_lookup = await asyncio.to_thread(get_cached_response, user_id, req.query, reply)
+    if cached is not None:
+        await append_turn(user_id, prompt, cached["response"])
+        return {**cached, "route": "cache"}
+
+    agent = get_agent()
+    context = {"user_id": user_id}
+    started = time.perf_counter()
+    try:
+        result = await agent.ainvoke(
+            {"messages": [HumanMessage(content=prompt)]},
+            config={"configurable": {"thread_id": user_id}, "callbacks": metrics_callbacks}, # <--- thread_id GOES HERE
+            context=context
+        )
+    except Exception:
+        bump_data_version(user_id)  # a tool may have written before the failure
+        raise
+    log_turn_usage(context, time.perf_counter() - started)
+    background_tasks.add_task(prune_checkpoints, user_id)
+    response = format_agent_response(result)
+    await asyncio.to_thread(record_turn, user_id, cache_lookup, turn_tool_calls(result["messages"]), response)
+    return {**response, "route": "agent"}
+
+
+@router.post("/chat/stream")
+async def Aichat_stream(req: chat, user_id: int = Depends(get_current_user)):
+    fast = await asyncio.to_thread(route_query, user_id, req.query)
+    await ensure_checkpointer()
+    prompt = build_prompt(user_id, req.query)
+    if fast is not None:
+        await append_turn(user_id, prompt, fast["response"])  # keep the agent's thread aware of fast-path turns
+        return sse_answer(fast)
+    reply = await last_reply(user_id) if RESPONSE_CACHE_ENABLED else ""
+    cached, cache_lookup = await asyncio.to_thread(get_cached_response, user_id, req.query, reply)
+    if cached is not None:
+        await append_turn(user_id, prompt, cached["response"])
+        return sse_answer({**cached, "route": "cache"})
+
+    agent = get_agent()
+
+    async def events():
+        final_message = None
+        tool_calls = []
+        context = {"user_id": user_id}
+        started = time.perf_counter()
+        try:
+            async for mode, chunk in agent.astream(
+                {"messages": [HumanMessage(content=prompt)]},
+                config={"configurable": {"thread_id": user_id}, "callbacks": metrics_callbacks},
+                context=context,
+                stream_mode=["updates", "messages"]
+            ):
+                if mode == "messages":
+                    token, metadata = chunk
+                    # Only the agent's own model node; the summarizer's call runs in its middleware node.
+                    if isinstance(token, AIMessage) and metadata.get("langgraph_node") == "model":  # AIMessageChunk while streaming, AIMessage otherwise
+                        text = chunk_text(token.content)
+                        if text:
+                            yield sse_event("token", {"text": text})
+                    continue
+
+                # "updates": one entry per graph node that finished in this step
+                for update in chunk.values():
+                    if not isinstance(update, dict):
+                        continue
+                    for message in update.get("messages", []):
+                        final_message = message
+                        for call in getattr(message, "tool_calls", None) or []:
+                            tool_calls.append(call)
+                            yield sse_event("tool_start", {"tool": call["name"]})  # args may hold model-written SQL
+                        if isinstance(message, ToolMessage):
+                            yield sse_event("tool_end", {"tool": message.name, "status": message.status})
+        except Exception as e:
+            await asyncio.to_thread(record_turn, user_id, None, tool_calls, None)  # a write may have committed
+            yield sse_event("error", {"detail": str(e)})
+            return
+
+        log_turn_usage(context, time.perf_counter() - started)
+        result = {"messages": [final_message]} if final_message is not None else {}
+        response = format_agent_response(result)
+        await asyncio.to_thread(record_turn, user_id, cache_lookup, tool_calls, response)
+        yield sse_event("final", {**response, "route": "agent"})
+        await prune_checkpoints(user_id)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def create_app() -> FastAPI:
+    """Build the FastAPI app; `main:app` below is the one served (gunicorn --preload builds it once, in the master)."""
+    app = FastAPI(title="Expense Tracker", lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=orging, # Now uses the configured environment variable list
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(router)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import re
+import time
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from database import Base, ExpenseMonthlyRollup, get_engine, session_scope
+from analytics import rebuild_rollup
+from partitioning import ensure_future_partitions, migrate_partitioning
+
+# Schema, index, partitioning and checkpoint-table setup, run once per deploy (Procfile `release:` phase) instead of
+# at import time in every worker:
+#
+#     python manage.py migrate
+
+
+def migrate_schema():
+    engine = get_engine()
+    had_rollup = inspect(engine).has_table(ExpenseMonthlyRollup.__tablename__)
+    Base.metadata.create_all(bind=engine)
+    if not had_rollup:
+        # A new rollup table starts empty; backfill it from the existing expenses.
+        with session_scope() as db:
+            rebuild_rollup(db)
+            db.commit()
+        print("Rollup table created and backfilled.")
+
+
+# Indexes superseded by the ones declared on the models.
+OBSOLETE_INDEXES = ("idx_user_date",)
+
+
+def migrate_indexes():
+    """Build declared indexes missing from existing tables without blocking writes, then drop obsolete ones."""
+    engine = get_engine()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind; rebuild those.
+        invalid = set(conn.execute(text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+        )).scalars())
+        partitioned = set(conn.execute(text(
+            "SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid"
+        )).scalars())
+        existing = {
+            index["name"]
+            for table in Base.metadata.tables
+            for index in inspect(conn).get_indexes(table)
+        }
+        changed = False
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in existing and index.name not in invalid:
+                    continue
+                if index.name in invalid:
+                    conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+                ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+                if table.name not in partitioned:  # CONCURRENTLY isn't supported on partitioned tables
+                    ddl = re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+                conn.execute(text(ddl))
+                print(f"Created index {index.name}.")
+                changed = True
+        for name in OBSOLETE_INDEXES:
+            if name in existing:
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+                print(f"Dropped index {name}.")
+        if changed:
+            conn.execute(text("ANALYZE " + ", ".join(table.name for table in Base.metadata.sorted_tables)))
+
+
+def migrate_checkpoints():
+    from agent import setup_checkpointer
+    asyncio.run(setup_checkpointer())
+
+
+def migrate():
+    for step in (migrate_schema, migrate_partitioning, migrate_indexes, migrate_checkpoints):
+        started = time.perf_counter()
+        step()
+        print(f"{step.__name__}: done in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deploy-time setup for the expense tracker.")
+    parser.add_argument("command", choices=["migrate", "ensure-partitions"])
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate()
+    else:
+        # Run from cron when expenses is range-partitioned, so inserts never fall into the default partition.
+        ensure_future_partitions()
@@ -0,0 +1,240 @@
+import os
+import time
+from contextvars import ContextVar
+from functools import wraps
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from sqlalchemy import event
+
+# Prometheus metrics for the HTTP, database, LLM, tool and checkpoint layers.
+# With several gunicorn workers set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates all of them.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_TRACE = os.getenv("METRICS_TRACE", "false").lower() == "true"  # one span line per request
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"], buckets=_LATENCY_BUCKETS)
+db_latency = Histogram("db_statement_duration_seconds", "SQL statement latency", ["statement"], buckets=_DB_BUCKETS)
+db_queries_per_request = Histogram("db_queries_per_request", "SQL statements per HTTP request", ["route"],
+                                   buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+llm_latency = Histogram("llm_call_duration_seconds", "LLM call latency", ["model"], buckets=_LATENCY_BUCKETS)
+llm_tokens = Counter("llm_tokens", "LLM tokens", ["model", "kind"])
+tool_latency = Histogram("tool_call_duration_seconds", "Agent tool call latency", ["tool", "status"], buckets=_LATENCY_BUCKETS)
+checkpoint_latency = Histogram("checkpoint_op_duration_seconds", "Checkpointer read/write latency", ["op"], buckets=_DB_BUCKETS)
+
+# Per-request counters shared with threadpool endpoints and agent tools (they inherit the context).
+_request_span = ContextVar("request_span", default=None)
+
+
+def _new_span() -> dict:
+    return {"db_queries": 0, "db_seconds": 0.0, "llm_calls": 0, "llm_seconds": 0.0, "tool_calls": 0, "tool_seconds": 0.0}
+
+
+def _add_to_span(**values):
+    span = _request_span.get()
+    if span is not None:
+        for key, value in values.items():
+            span[key] += value
+
+
+# --- Existing in-process stats (caches, pools, queues) exposed as gauges ---
+_stats_sources = {}
+
+
+def register_stats(name: str, source):
+    """Expose a dict-returning stats() callable as gauges named app_<name>_<field>."""
+    _stats_sources[name] = source
+
+
+def _flatten(prefix: str, value, out: dict):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}_{key}", item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+
+class _StatsCollector:
+    def collect(self):
+        for name, source in list(_stats_sources.items()):
+            try:
+                values = {}
+                _flatten(f"app_{name}", source(), values)
+            except Exception as e:
+                print(f"Stats source {name} failed: {e}")
+                continue
+            for metric, value in values.items():
+                gauge = GaugeMetricFamily(metric, f"{name} stats (this worker)", labels=["pid"])
+                gauge.add_metric([str(os.getpid())], value)
+                yield gauge
+
+
+def metrics_payload():
+    """(body, content type) for the /metrics endpoint."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_StatsCollector())
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+if not MULTIPROC_DIR:
+    REGISTRY.register(_StatsCollector())
+
+
+# --- HTTP ---
+class MetricsMiddleware:
+    """Pure ASGI middleware (keeps streaming responses streaming) recording per-route latency."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED or scope["path"] == "/metrics":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        span = _new_span()
+        token = _request_span.set(span)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_span.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_latency.labels(scope["method"], route, str(status)).observe(elapsed)
+            db_queries_per_request.labels(route).observe(span["db_queries"])
+            if METRICS_TRACE:
+                print(
+                    f"trace {scope['method']} {route} {status} {elapsed * 1000:.1f}ms "
+                    f"db={span['db_queries']}/{span['db_seconds'] * 1000:.1f}ms "
+                    f"llm={span['llm_calls']}/{span['llm_seconds'] * 1000:.1f}ms "
+                    f"tools={span['tool_calls']}/{span['tool_seconds'] * 1000:.1f}ms"
+                )
+
+
+# --- Database ---
+_STATEMENT_KINDS = ("select", "insert", "update", "delete", "with", "copy")
+_db_children = {}
+
+
+def _db_histogram(statement: str):
+    head = statement[:8].lstrip().lower()
+    kind = next((k for k in _STATEMENT_KINDS if head.startswith(k)), "other")
+    child = _db_children.get(kind)
+    if child is None:
+        child = _db_children[kind] = db_latency.labels(kind)
+    return child
+
+
+def instrument_engine(engine):
+    if not METRICS_ENABLED or getattr(engine, "_metrics_instrumented", False):
+        return
+    engine._metrics_instrumented = True  # the lifespan may run more than once per process (tests, benchmarks)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        _db_histogram(statement).observe(elapsed)
+        span = _request_span.get()
+        if span is not None:
+            span["db_queries"] += 1
+            span["db_seconds"] += elapsed
+
+
+# --- LLM and tools ---
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Times LLM and tool runs and counts tokens; pass it in the invoke config's callbacks."""
+
+    run_inline = True  # record on the event loop instead of hopping to a thread per event
+
+    def __init__(self):
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        model = (kwargs.get("metadata") or {}).get("ls_model_name") or (serialized or {}).get("name", "unknown")
+        self._runs[run_id] = (time.perf_counter(), model)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, **kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, model = self._runs.pop(run_id, (None, "unknown"))
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            llm_latency.labels(model).observe(elapsed)
+            _add_to_span(llm_calls=1, llm_seconds=elapsed)
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                llm_tokens.labels(model, "input").inc(usage.get("input_tokens", 0))
+                llm_tokens.labels(model, "output").inc(usage.get("output_tokens", 0))
+                llm_tokens.labels(model, "cached").inc((usage.get("input_token_details") or {}).get("cache_read", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started, model = self._runs.pop(run_id, (None, "unknown"))
+        if started is not None:
+            llm_latency.labels(model).observe(time.perf_counter() - started)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._runs[run_id] = (time.perf_counter(), (serialized or {}).get("name") or kwargs.get("name", "unknown"))
+
+    def _tool_done(self, run_id, status):
+        started, tool = self._runs.pop(run_id, (None, "unknown"))
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            tool_latency.labels(tool, status).observe(elapsed)
+            _add_to_span(tool_calls=1, tool_seconds=elapsed)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._tool_done(run_id, "ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._tool_done(run_id, "error")
+
+
+metrics_callbacks = [MetricsCallbackHandler()] if METRICS_ENABLED else []
+
+
+# --- Checkpointer ---
+def instrument_checkpointer(saver):
+    """Wrap the saver's async read/write methods with timers (in place)."""
+    if not METRICS_ENABLED:
+        return saver
+    for method, op in (("aget_tuple", "get"), ("aput", "put"), ("aput_writes", "put_writes")):
+        original = getattr(saver, method)
+
+        def timed(original=original, op=op):
+            @wraps(original)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    checkpoint_latency.labels(op).observe(time.perf_counter() - started)
+            return wrapper
+
+        setattr(saver, method, timed())
+    return saver
@@ -0,0 +1,191 @@
+import os
+import re
+import time
+from datetime import date
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+from database import Expenses, get_engine
+
+# Optional declarative partitioning of the expenses table, applied by `python manage.py migrate`:
+#   EXPENSES_PARTITIONING=range-year | range-month   PARTITION BY RANGE (date); NULL and out-of-range
+#                                                   dates land in expenses_default
+#   EXPENSES_PARTITIONING=hash:16                    PARTITION BY HASH (user_id) into 16 partitions
+# Unset or "none" keeps the plain table. The ORM model and queries are unchanged; date-range filters
+# are pruned to the matching range partitions, user_id filters to a single hash partition.
+
+PARTITIONING = os.getenv("EXPENSES_PARTITIONING", "none").lower()
+PARTITIONS_AHEAD = int(os.getenv("PARTITIONS_AHEAD", "12"))  # future range partitions kept ready (years or months)
+_DDL_LOCK = 734001  # advisory lock serializing partition DDL between workers and cron runs
+_TABLE = Expenses.__tablename__
+
+
+def parse_mode(mode: str = None):
+    """("none", None), ("range", "year" | "month") or ("hash", modulus)."""
+    mode = (mode or PARTITIONING).strip().lower()
+    if mode in ("", "none"):
+        return "none", None
+    if mode in ("range-year", "range-month"):
+        return "range", mode.split("-")[1]
+    match = re.fullmatch(r"hash:(\d+)", mode)
+    if match and int(match.group(1)) > 1:
+        return "hash", int(match.group(1))
+    raise ValueError(f"Unsupported EXPENSES_PARTITIONING value: {mode!r}")
+
+
+def current_layout(conn):
+    """The table's partitioning as stored in the catalog, in parse_mode's format."""
+    strategy = conn.execute(text(
+        "SELECT p.partstrat FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table AND pg_table_is_visible(c.oid)"
+    ), {"table": _TABLE}).scalar()
+    if strategy is None:
+        return "none", None
+    children = _partitions(conn)
+    if strategy == "h":
+        return "hash", len(children)
+    return "range", "month" if any(re.fullmatch(rf"{_TABLE}_m\d{{4}}_\d{{2}}", c) for c in children) else "year"
+
+
+def _partitions(conn) -> list:
+    return list(conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:table AS regclass) ORDER BY c.relname"
+    ), {"table": _TABLE}).scalars())
+
+
+# --- Range partitions ---
+def _period_start(day: date, unit: str) -> date:
+    return day.replace(month=1, day=1) if unit == "year" else day.replace(day=1)
+
+
+def _next_period(start: date, unit: str) -> date:
+    if unit == "year":
+        return start.replace(year=start.year + 1)
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+
+def _range_name(start: date, unit: str) -> str:
+    return f"{_TABLE}_y{start.year}" if unit == "year" else f"{_TABLE}_m{start.year}_{start.month:02d}"
+
+
+def _periods(first: date, last: date, unit: str):
+    start = _period_start(first, unit)
+    while start <= last:
+        yield start
+        start = _next_period(start, unit)
+
+
+def _ahead(unit: str) -> date:
+    end = _period_start(date.today(), unit)
+    for _ in range(PARTITIONS_AHEAD):
+        end = _next_period(end, unit)
+    return end
+
+
+def _create_range_partition(conn, start: date, unit: str):
+    """Create one range partition; rows already sitting in the default partition for that range move into it."""
+    name, end = _range_name(start, unit), _next_period(start, unit)
+    bounds = {"start": start, "end": end}
+    conn.execute(text(f'CREATE TABLE "{name}" (LIKE {_TABLE} INCLUDING DEFAULTS)'))
+    conn.execute(text(
+        f'WITH moved AS (DELETE FROM {_TABLE}_default WHERE date >= :start AND date < :end RETURNING *) '
+        f'INSERT INTO "{name}" SELECT * FROM moved'
+    ), bounds)
+    conn.execute(text(
+        f"ALTER TABLE {_TABLE} ATTACH PARTITION \"{name}\" FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+
+
+def ensure_future_partitions(engine=None) -> list:
+    """Keep PARTITIONS_AHEAD range partitions ready past the current period; returns the names created."""
+    engine = engine or get_engine()
+    created = []
+    with engine.begin() as conn:
+        kind, unit = current_layout(conn)
+        if kind != "range":
+            return created
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _DDL_LOCK})
+        existing = set(_partitions(conn))
+        for start in _periods(date.today(), _ahead(unit), unit):
+            if _range_name(start, unit) not in existing:
+                _create_range_partition(conn, start, unit)
+                created.append(_range_name(start, unit))
+    if created:
+        print(f"Created partitions: {', '.join(created)}")
+    return created
+
+
+# --- Migration from the plain table ---
+def partition_table(conn, kind: str, option):
+    """Rebuild expenses as a partitioned table inside the caller's transaction, keeping ids and the id sequence.
+
+    Writes wait from the start; reads keep using the old table until the final swap.
+    """
+    conn.execute(text(f"LOCK TABLE {_TABLE} IN EXCLUSIVE MODE"))
+    sequence = conn.execute(text(f"SELECT pg_get_serial_sequence('{_TABLE}', 'id')")).scalar()
+    staging = f"{_TABLE}_partitioned"
+    if kind == "range":
+        conn.execute(text(f"CREATE TABLE {staging} (LIKE {_TABLE} INCLUDING DEFAULTS) PARTITION BY RANGE (date)"))
+        conn.execute(text(f"CREATE TABLE {_TABLE}_default PARTITION OF {staging} DEFAULT"))
+        first, last = conn.execute(text(f"SELECT min(date), max(date) FROM {_TABLE}")).one()
+        today = date.today()
+        for start in _periods(min(first or today, today), max(last or today, _ahead(option)), option):
+            conn.execute(text(
+                f"CREATE TABLE \"{_range_name(start, option)}\" PARTITION OF {staging} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{_next_period(start, option).isoformat()}')"
+            ))
+    else:
+        conn.execute(text(f"CREATE TABLE {staging} (LIKE {_TABLE} INCLUDING DEFAULTS) PARTITION BY HASH (user_id)"))
+        for remainder in range(option):
+            conn.execute(text(
+                f"CREATE TABLE {_TABLE}_h{remainder:02d} PARTITION OF {staging} "
+                f"FOR VALUES WITH (MODULUS {option}, REMAINDER {remainder})"
+            ))
+
+    columns = ", ".join(c.name for c in Expenses.__table__.columns)
+    conn.execute(text(f"INSERT INTO {staging} ({columns}) SELECT {columns} FROM {_TABLE}"))
+
+    # Keys and indexes are built after the copy, under the final names, so the old ones step aside first.
+    # Unique constraints must contain the partition key: hash tables get PRIMARY KEY (id, user_id);
+    # range tables get a plain id index because date is nullable.
+    old_indexes = conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+    ), {"table": _TABLE}).scalars().all()
+    for name in old_indexes:
+        conn.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name[:55]}_old"'))
+    if kind == "hash":
+        conn.execute(text(f"ALTER TABLE {staging} ADD CONSTRAINT {_TABLE}_pkey PRIMARY KEY (id, user_id)"))
+    else:
+        conn.execute(text(f"CREATE INDEX idx_{_TABLE}_id ON {staging} (id)"))
+    for index in Expenses.__table__.indexes:
+        ddl = str(CreateIndex(index).compile(dialect=conn.dialect))
+        conn.execute(text(ddl.replace(f" ON {_TABLE} ", f" ON {staging} ", 1)))
+    conn.execute(text(
+        f"ALTER TABLE {staging} ADD CONSTRAINT {_TABLE}_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE"
+    ))
+
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {staging}.id"))  # survives dropping the old table
+    conn.execute(text(f"DROP TABLE {_TABLE}"))
+    conn.execute(text(f"ALTER TABLE {staging} RENAME TO {_TABLE}"))
+
+
+def migrate_partitioning(mode: str = None):
+    kind, option = parse_mode(mode)
+    engine = get_engine()
+    migrated = False
+    with engine.begin() as conn:
+        layout = current_layout(conn)
+        if layout[0] == "none" and kind != "none":
+            started = time.perf_counter()
+            rows = conn.execute(text(f"SELECT count(*) FROM {_TABLE}")).scalar()
+            partition_table(conn, kind, option)
+            migrated = True
+            print(f"Partitioned {_TABLE} ({kind} {option}): {rows} rows moved in {time.perf_counter() - started:.1f}s")
+        elif layout[0] != kind:
+            # Changing or removing an existing layout is a manual operation.
+            print(f"{_TABLE} is partitioned as {layout}; EXPENSES_PARTITIONING={mode or PARTITIONING} is ignored")
+    if migrated:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"ANALYZE {_TABLE}"))
+    ensure_future_partitions(engine)
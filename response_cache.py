@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+from collections import Counter
+from datetime import date
+import redis
+import authorization
+from agent import is_read_only_call
+from cache import TTLCache
+from intent_router import normalize
+
+# Cache for read-only agent turns, keyed on (user, normalized query, data version, the thread's last reply).
+# The last reply pins the conversation state, so a follow-up like "yes" is only reused after the same question.
+# Every write path bumps the user's data version, so stale entries are simply never read again
+# and age out through their TTL (run Redis with maxmemory-policy volatile-lru to bound memory).
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "600"))
+# Per-process fallback when Redis is down; only safe with a single worker, since a write on one
+# worker can't invalidate another worker's entries.
+RESPONSE_CACHE_LOCAL = os.getenv("RESPONSE_CACHE_LOCAL", "false").lower() == "true"
+
+_local_responses = TTLCache(max_size=int(os.getenv("RESPONSE_CACHE_LOCAL_SIZE", "1024")), ttl=RESPONSE_CACHE_TTL)
+_local_versions = Counter()
+_versions_lock = threading.Lock()
+counters = Counter()
+
+
+def _version_key(user_id: int) -> str:
+    return f"datav:{user_id}"
+
+
+def data_version(user_id: int):
+    """Current data version of the user, or None when no cache backend is usable."""
+    if authorization.r is not None:
+        try:
+            return int(authorization.r.get(_version_key(user_id)) or 0)
+        except redis.RedisError:
+            pass
+    if RESPONSE_CACHE_LOCAL:
+        with _versions_lock:
+            return _local_versions[user_id]
+    return None
+
+
+def bump_data_version(user_id: int):
+    """Call after committing any write to the user's expenses."""
+    with _versions_lock:
+        _local_versions[user_id] += 1
+    if authorization.r is not None:
+        try:
+            authorization.r.incr(_version_key(user_id))
+        except redis.RedisError as e:
+            print(f"Could not bump data version for user {user_id}: {e}")
+
+
+def cache_key(user_id: int, query: str, version: int, last_reply: str = "") -> str:
+    # The date is part of the key because the prompt resolves "today"/"this month" against it.
+    digest = hashlib.sha1(f"{normalize(query)}\0{last_reply}".encode()).hexdigest()
+    return f"respcache:{user_id}:{version}:{date.today().isoformat()}:{digest}"
+
+
+def get_cached_response(user_id: int, query: str, last_reply: str = ""):
+    """Returns (cached response or None, lookup to pass to record_turn or None)."""
+    if not RESPONSE_CACHE_ENABLED:
+        return None, None
+    version = data_version(user_id)
+    if version is None:
+        counters["bypass"] += 1
+        return None, None
+    key = cache_key(user_id, query, version, last_reply)
+    cached = None
+    if authorization.r is not None:
+        try:
+            raw = authorization.r.get(key)
+            cached = json.loads(raw) if raw else None
+        except redis.RedisError:
+            cached = _local_responses.get(key) if RESPONSE_CACHE_LOCAL else None
+    else:
+        cached = _local_responses.get(key)
+    counters["hits" if cached is not None else "misses"] += 1
+    return cached, (query, version, last_reply)
+
+
+def store_response(key: str, payload: dict):
+    if authorization.r is not None:
+        try:
+            authorization.r.setex(key, RESPONSE_CACHE_TTL, json.dumps(payload))
+            counters["stores"] += 1
+            return
+        except redis.RedisError:
+            pass
+    if RESPONSE_CACHE_LOCAL:
+        _local_responses.set(key, payload)
+        counters["stores"] += 1
+
+
+def classify_turn(tool_calls) -> str:
+    """'read' if the turn only used read tools, 'write' if any call may have written, else 'none'."""
+    if not tool_calls:
+        return "none"
+    return "read" if all(is_read_only_call(c) for c in tool_calls) else "write"
+
+
+def turn_tool_calls(messages) -> list:
+    """Tool calls made after the last human message, i.e. during the current turn."""
+    calls = []
+    for message in reversed(messages):
+        if message.type == "human":
+            break
+        calls.extend(getattr(message, "tool_calls", None) or [])
+    return calls
+
+
+def asks_user(response: dict) -> bool:
+    """Turns that end on a question (e.g. a confirmation prompt) depend on the reply and are never cached."""
+    return str(response.get("response", "")).rstrip().endswith("?")
+
+
+def record_turn(user_id: int, lookup, tool_calls, response: dict):
+    """After an agent turn: invalidate on writes, cache answers built only from reads."""
+    kind = classify_turn(tool_calls)
+    if kind == "write":
+        bump_data_version(user_id)
+    elif kind == "read" and lookup and not asks_user(response):
+        query, version, last_reply = lookup
+        store_response(cache_key(user_id, query, version, last_reply), response)
+        # The same question asked again right after this answer gets the same answer.
+        store_response(cache_key(user_id, query, version, response["response"]), response)
+
+
+def response_cache_stats() -> dict:
+    lookups = counters["hits"] + counters["misses"]
+    return {
+        **counters,
+        "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+        "local": _local_responses.stats(),
+    }
@@ -0,0 +1,226 @@
+import os
+import re
+from decimal import Decimal
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from analytics import apply_rollup
+from cache import TTLCache
+from database import session_scope
+
+# Gateway for LLM-written SQL: the statement is parsed, checked against the caller's user_id,
+# capped in rows, time and planner cost, and only then executed.
+
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "200"))
+SQL_MAX_INSERT_ROWS = int(os.getenv("SQL_MAX_INSERT_ROWS", "50"))
+SQL_MAX_COST = float(os.getenv("SQL_MAX_COST", "50000"))
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "5000"))
+
+READABLE_TABLES = {"expenses", "expense_monthly_rollup"}
+INSERT_COLUMNS = {"user_id", "category", "amount", "amount_type", "date"}
+REQUIRED_INSERT_COLUMNS = {"user_id", "category", "amount", "amount_type"}
+_DENIED_FUNCTIONS = re.compile(r"^(pg_|lo_|dblink|set_config|current_setting|query_to_xml|txid_)", re.IGNORECASE)
+_WRITES = (exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter, exp.Command, exp.Into, exp.Lock)
+
+# (user_id, sql) -> (kind, rendered sql); entries are only added after validation and the cost check.
+validated_statements = TTLCache(max_size=int(os.getenv("SQL_GUARD_CACHE_SIZE", "512")),
+                                ttl=int(os.getenv("SQL_GUARD_CACHE_TTL", "300")))
+
+
+class QueryRejected(ValueError):
+    pass
+
+
+def _conjuncts(node):
+    if isinstance(node, exp.And):
+        yield from _conjuncts(node.left)
+        yield from _conjuncts(node.right)
+    elif isinstance(node, exp.Paren):
+        yield from _conjuncts(node.this)
+    else:
+        yield node
+
+
+def _is_user_filter(node, user_id: int, qualifiers: set) -> bool:
+    if not isinstance(node, exp.EQ):
+        return False
+    for column, value in ((node.left, node.right), (node.right, node.left)):
+        if (isinstance(column, exp.Column) and column.name.lower() == "user_id"
+                and column.table.lower() in qualifiers
+                and isinstance(value, exp.Literal) and not value.is_string and value.this == str(user_id)):
+            return True
+    return False
+
+
+def _cte_names(ctes) -> set:
+    return {cte.alias_or_name.lower() for cte in ctes}
+
+
+def _is_cte_reference(table: exp.Table) -> bool:
+    """Whether the table name resolves to a CTE in scope rather than a real table.
+
+    A CTE is visible in its statement's body and in the CTEs defined after it; inside its own
+    definition the name still means the real table unless the WITH is RECURSIVE.
+    """
+    if table.db or table.catalog:
+        return False
+    name = table.name.lower()
+    node = table
+    while node.parent is not None:
+        parent = node.parent
+        if isinstance(parent, exp.With) and isinstance(node, exp.CTE):
+            visible = parent.expressions if parent.args.get("recursive") else parent.expressions[:node.index]
+            if name in _cte_names(visible):
+                return True
+        elif isinstance(parent.args.get("with"), exp.With) and node is not parent.args["with"]:
+            if name in _cte_names(parent.args["with"].expressions):
+                return True
+        node = parent
+    return False
+
+
+def _check_select(select: exp.Select, user_id: int):
+    if select.args.get("into") or select.args.get("locks"):
+        raise QueryRejected("SELECT INTO and row locks are not allowed.")
+    sources = []
+    if select.args.get("from"):
+        sources.append(select.args["from"].this)
+    sources.extend(join.this for join in select.args.get("joins") or [])
+    tables = [s for s in sources if isinstance(s, exp.Table) and not _is_cte_reference(s)]
+    conjuncts = list(_conjuncts(select.args["where"].this)) if select.args.get("where") else []
+    for table in tables:
+        qualifiers = {table.alias_or_name.lower()}
+        if len(sources) == 1:
+            qualifiers.add("")  # an unqualified user_id is unambiguous with a single source
+        if not any(_is_user_filter(c, user_id, qualifiers) for c in conjuncts):
+            raise QueryRejected(f"Every read of {table.name} must be filtered with {table.alias_or_name}.user_id = {user_id}.")
+
+
+def _check_tables(statement):
+    for table in statement.find_all(exp.Table):
+        name = table.name.lower()
+        if _is_cte_reference(table):
+            continue
+        if name not in READABLE_TABLES or (table.db and table.db.lower() != "public") or table.catalog:
+            raise QueryRejected(f"Table {table.sql()} is not accessible.")
+    for func in statement.find_all(exp.Anonymous):
+        if _DENIED_FUNCTIONS.match(func.name):
+            raise QueryRejected(f"Function {func.name} is not allowed.")
+
+
+def _validate_select(statement, user_id: int) -> str:
+    if statement.find(*_WRITES):
+        raise QueryRejected("Only read-only SELECT statements are allowed here.")
+    _check_tables(statement)
+    for select in statement.find_all(exp.Select):
+        _check_select(select, user_id)
+
+    limit = statement.args.get("limit")
+    value = limit.expression if limit is not None else None
+    if not (isinstance(value, exp.Literal) and value.is_int and int(value.this) <= SQL_MAX_ROWS):
+        statement.limit(SQL_MAX_ROWS, copy=False)
+    return statement.sql(dialect="postgres")
+
+
+def _is_constant(node) -> bool:
+    """A literal, NULL, TRUE/FALSE, CURRENT_DATE, or a negation or cast of one; no functions or subqueries."""
+    if isinstance(node, (exp.Neg, exp.Cast, exp.Paren)):
+        return _is_constant(node.this)
+    return isinstance(node, (exp.Literal, exp.Null, exp.Boolean, exp.CurrentDate))
+
+
+def _validate_insert(statement, user_id: int) -> str:
+    target = statement.this
+    if not isinstance(target, exp.Schema) or not isinstance(target.this, exp.Table):
+        raise QueryRejected("INSERT must list its columns explicitly.")
+    if target.this.name.lower() != "expenses" or target.this.db not in ("", "public"):
+        raise QueryRejected("INSERT is only allowed into expenses.")
+    columns = [c.name.lower() for c in target.expressions]
+    if not set(columns) <= INSERT_COLUMNS or not REQUIRED_INSERT_COLUMNS <= set(columns):
+        raise QueryRejected(f"INSERT columns must include {sorted(REQUIRED_INSERT_COLUMNS)} and be within {sorted(INSERT_COLUMNS)}.")
+    values = statement.expression
+    if not isinstance(values, exp.Values) or statement.args.get("conflict") or statement.args.get("with"):
+        raise QueryRejected("INSERT must use a plain VALUES list.")
+    if len(values.expressions) > SQL_MAX_INSERT_ROWS:
+        raise QueryRejected(f"At most {SQL_MAX_INSERT_ROWS} rows per INSERT.")
+    for row in values.expressions:
+        if len(row.expressions) != len(columns):
+            raise QueryRejected("Every VALUES row must match the column list.")
+        if not all(_is_constant(cell) for cell in row.expressions):
+            raise QueryRejected("VALUES may only contain literal values.")
+        cells = dict(zip(columns, row.expressions))
+        owner = cells["user_id"]
+        if not (isinstance(owner, exp.Literal) and not owner.is_string and owner.this == str(user_id)):
+            raise QueryRejected(f"user_id must be {user_id}.")
+        kind = cells["amount_type"]
+        if not (isinstance(kind, exp.Literal) and kind.is_string and kind.this.upper() in ("DEBIT", "CREDIT")):
+            raise QueryRejected("amount_type must be 'DEBIT' or 'CREDIT'.")
+        kind.set("this", kind.this.upper())  # stored by enum name
+    # The returned rows feed the monthly rollup.
+    statement.set("returning", exp.Returning(expressions=[exp.column(c) for c in ("date", "category", "amount_type", "amount")]))
+    return statement.sql(dialect="postgres")
+
+
+def validate(sql: str, user_id: int):
+    """Parse and check one statement; returns (kind, rewritten sql) or raises QueryRejected."""
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+    except sqlglot.errors.ParseError as e:
+        raise QueryRejected(f"Could not parse the query: {e}") from None
+    if len(statements) != 1:
+        raise QueryRejected("Exactly one statement is allowed.")
+    statement = statements[0]
+    if isinstance(statement, (exp.Select, exp.SetOperation)):
+        return "select", _validate_select(statement, user_id)
+    if isinstance(statement, exp.Insert):
+        return "insert", _validate_insert(statement, user_id)
+    raise QueryRejected("Only SELECT and INSERT statements are allowed.")
+
+
+def _compact(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def run_query(sql: str, user_id: int):
+    """Validate and run LLM-written SQL for user_id; returns row dicts or a short message."""
+    sql = sql.replace("strftime('%Y-%m', date)", "TO_CHAR(date, 'YYYY-MM')")
+    key = (user_id, sql)
+    cached = validated_statements.get(key)
+    try:
+        kind, statement = cached or validate(sql, user_id)
+    except QueryRejected as e:
+        return f"Query rejected: {e}"
+
+    with session_scope() as db:
+        db.execute(text("SELECT set_config('statement_timeout', :ms, true)"), {"ms": str(SQL_STATEMENT_TIMEOUT_MS)})
+        conn = db.connection()
+        driver_sql = statement.replace("%", "%%")  # executed with an empty parameter tuple, so escape format markers
+        try:
+            if kind == "select" and cached is None:
+                plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + driver_sql, ()).scalar()
+                cost = plan[0]["Plan"]["Total Cost"]
+                if cost > SQL_MAX_COST:
+                    return f"Query rejected: estimated cost {cost:.0f} exceeds {SQL_MAX_COST:.0f}; add filters or aggregate less data."
+            result = conn.exec_driver_sql(driver_sql, ())
+            if kind == "insert":
+                rows = result.all()  # RETURNING date, category, amount_type, amount
+                apply_rollup(db, user_id, added=rows)
+            else:
+                rows = [{k: _compact(v) for k, v in row.items()} for row in result.mappings()]
+            db.commit()
+        except DBAPIError as e:
+            db.rollback()
+            if (getattr(e.orig, "sqlstate", None) or getattr(e.orig, "pgcode", None)) == "57014":  # query_canceled
+                return f"Query cancelled: it ran longer than {SQL_STATEMENT_TIMEOUT_MS} ms."
+            return f"Query failed: {str(e.orig).strip()}"
+
+    if cached is None:
+        validated_statements.set(key, (kind, statement))
+    if kind == "insert":
+        return f"{len(rows)} row(s) inserted."
+    return rows
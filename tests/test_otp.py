@@ -0,0 +1,159 @@
+"""OTP issue/verify Lua scripts against fakeredis (Lua via lupa).
+
+    pip install -r tests/requirements.txt && python -m pytest tests
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import fakeredis
+import pytest
+from fastapi import HTTPException
+
+import authorization
+
+EMAIL = "otp@example.com"
+
+
+@pytest.fixture(autouse=True)
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(authorization, "r", client)
+    return client
+
+
+def test_correct_otp_is_consumed_once():
+    otp = authorization.generate_otp(EMAIL)
+    assert authorization.verify_otp(EMAIL, otp)
+    assert not authorization.verify_otp(EMAIL, otp)
+
+
+def test_concurrent_verify_has_a_single_winner(monkeypatch):
+    monkeypatch.setattr(authorization, "VERIFY_RATE_LIMIT", 100)
+    otp = authorization.generate_otp(EMAIL)
+    callers = 20
+    start = threading.Barrier(callers)
+
+    def verify(_):
+        start.wait()
+        return authorization.verify_otp(EMAIL, otp)
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        results = list(pool.map(verify, range(callers)))
+    assert results.count(True) == 1
+
+
+def test_wrong_guesses_below_the_limit_keep_the_otp():
+    otp = authorization.generate_otp(EMAIL)
+    for _ in range(authorization.OTP_MAX_ATTEMPTS - 1):
+        assert not authorization.verify_otp(EMAIL, otp + 1)
+    assert authorization.verify_otp(EMAIL, otp)
+
+
+def test_otp_is_invalidated_after_max_attempts(redis_client):
+    otp = authorization.generate_otp(EMAIL)
+    for _ in range(authorization.OTP_MAX_ATTEMPTS):
+        assert not authorization.verify_otp(EMAIL, otp + 1)
+    assert redis_client.get(f"otp:{EMAIL}") is None
+    assert not authorization.verify_otp(EMAIL, otp)
+
+
+def test_new_otp_resets_failed_attempts():
+    otp = authorization.generate_otp(EMAIL)
+    for _ in range(authorization.OTP_MAX_ATTEMPTS - 1):
+        authorization.verify_otp(EMAIL, otp + 1)
+    otp = authorization.generate_otp(EMAIL)
+    assert not authorization.verify_otp(EMAIL, otp + 1)
+    assert authorization.verify_otp(EMAIL, otp)
+
+
+def test_failed_attempts_expire_with_the_otp(redis_client):
+    authorization.generate_otp(EMAIL, expire_minutes=1)
+    authorization.verify_otp(EMAIL, 0)
+    assert 0 < redis_client.pttl(f"otp_attempts:{EMAIL}") <= 60_000
+
+
+def _assert_rate_limited(call):
+    with pytest.raises(HTTPException) as error:
+        call()
+    assert error.value.status_code == 429
+    assert error.value.headers["Retry-After"] == str(authorization.RATE_LIMIT_WINDOW)
+
+
+def test_issue_is_rate_limited_per_email():
+    for _ in range(authorization.REGISTER_RATE_LIMIT):
+        authorization.generate_otp(EMAIL)
+    _assert_rate_limited(lambda: authorization.generate_otp(EMAIL))
+    authorization.generate_otp("other@example.com")
+
+
+def test_verify_is_rate_limited_per_ip():
+    for i in range(authorization.VERIFY_RATE_LIMIT):
+        authorization.verify_otp(f"user{i}@example.com", 0, client_ip="10.0.0.1")
+    _assert_rate_limited(lambda: authorization.verify_otp("late@example.com", 0, client_ip="10.0.0.1"))
+    assert not authorization.verify_otp("late@example.com", 0, client_ip="10.0.0.2")
+
+
+def test_rejected_calls_do_not_extend_the_window():
+    for _ in range(authorization.VERIFY_RATE_LIMIT):
+        authorization.verify_otp(EMAIL, 0)
+    for _ in range(3):
+        _assert_rate_limited(lambda: authorization.verify_otp(EMAIL, 0))
+    assert authorization.r.zcard(f"rl:verify:email:{EMAIL}") == authorization.VERIFY_RATE_LIMIT
+
+
+def test_window_slides(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(authorization.time, "time", lambda: now[0])
+    for _ in range(authorization.REGISTER_RATE_LIMIT):
+        authorization.generate_otp(EMAIL)
+    _assert_rate_limited(lambda: authorization.generate_otp(EMAIL))
+    now[0] += authorization.RATE_LIMIT_WINDOW + 1
+    otp = authorization.generate_otp(EMAIL)
+    assert authorization.verify_otp(EMAIL, otp)
+
+
+def test_check_without_consuming_then_take():
+    otp = authorization.generate_otp(EMAIL)
+    assert authorization.verify_otp(EMAIL, otp, consume=False)
+    assert authorization.take_otp(EMAIL, otp)
+    assert not authorization.take_otp(EMAIL, otp)
+    assert not authorization.verify_otp(EMAIL, otp)
+
+
+def test_unconsumed_check_still_counts_wrong_guesses_and_rate_limit():
+    otp = authorization.generate_otp(EMAIL)
+    for _ in range(authorization.OTP_MAX_ATTEMPTS):
+        assert not authorization.verify_otp(EMAIL, otp + 1, consume=False)
+    assert not authorization.take_otp(EMAIL, otp)
+    for _ in range(authorization.VERIFY_RATE_LIMIT - authorization.OTP_MAX_ATTEMPTS):
+        authorization.verify_otp(EMAIL, otp, consume=False)
+    _assert_rate_limited(lambda: authorization.verify_otp(EMAIL, otp, consume=False))
+
+
+def test_take_otp_has_a_single_winner():
+    otp = authorization.generate_otp(EMAIL)
+    callers = 20
+    start = threading.Barrier(callers)
+
+    def take(_):
+        start.wait()
+        return authorization.take_otp(EMAIL, otp)
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        assert list(pool.map(take, range(callers))).count(True) == 1
+
+
+def test_failed_delivery_releases_the_otp_and_the_rate_limit_slot(redis_client):
+    def fail(otp):
+        raise HTTPException(status_code=503)
+
+    for _ in range(authorization.REGISTER_RATE_LIMIT):
+        with pytest.raises(HTTPException):
+            authorization.generate_otp(EMAIL, client_ip="10.0.0.1", deliver=fail)
+    assert redis_client.get(f"otp:{EMAIL}") is None
+    assert redis_client.zcard(f"rl:register:email:{EMAIL}") == 0
+    assert redis_client.zcard("rl:register:ip:10.0.0.1") == 0
+    delivered = []
+    otp = authorization.generate_otp(EMAIL, client_ip="10.0.0.1", deliver=delivered.append)
+    assert delivered == [otp]
+    assert authorization.verify_otp(EMAIL, otp)
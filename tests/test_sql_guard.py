@@ -0,0 +1,146 @@
+"""sql_guard.validate: parsing, user scoping and row caps for LLM-written SQL (no database needed)."""
+import pytest
+
+from sql_guard import SQL_MAX_ROWS, QueryRejected, validate
+
+USER = 5
+
+
+def rejected(sql: str) -> str:
+    with pytest.raises(QueryRejected) as error:
+        validate(sql, USER)
+    return str(error.value)
+
+
+def test_scoped_select_is_accepted_and_capped():
+    kind, sql = validate(f"SELECT category, sum(amount) FROM expenses WHERE user_id = {USER} GROUP BY category", USER)
+    assert kind == "select"
+    assert sql.endswith(f"LIMIT {SQL_MAX_ROWS}")
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM expenses",
+    "SELECT * FROM expenses WHERE category = 'food'",
+    "SELECT * FROM expenses WHERE user_id = 6",
+    "SELECT * FROM expenses WHERE user_id = '5'",
+    "SELECT * FROM expenses WHERE user_id = 5 OR user_id = 6",
+    "SELECT * FROM expenses WHERE user_id = 5 OR 1 = 1",
+    "SELECT * FROM expenses WHERE (user_id = 5 OR category = 'x') AND amount > 0",
+    "SELECT * FROM expenses WHERE user_id <> 5",
+    "SELECT * FROM expenses e JOIN expenses f ON e.id = f.id WHERE e.user_id = 5",
+    "SELECT * FROM expenses WHERE user_id = 5 UNION SELECT * FROM expenses WHERE amount > 0",
+    "SELECT * FROM expenses WHERE user_id = 5 AND id IN (SELECT id FROM expenses)",
+])
+def test_every_read_needs_a_user_id_conjunct(sql):
+    assert "user_id" in rejected(sql)
+
+
+def test_qualified_user_filter_on_each_join_side_is_accepted():
+    validate("SELECT * FROM expenses e JOIN expense_monthly_rollup r ON e.user_id = r.user_id "
+             "WHERE e.user_id = 5 AND r.user_id = 5", USER)
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH expenses AS (SELECT * FROM expenses) SELECT * FROM expenses",
+    "WITH expenses AS (SELECT * FROM expenses) SELECT * FROM expenses WHERE user_id = 5",
+    "WITH e AS (SELECT * FROM expenses) SELECT * FROM e WHERE user_id = 5",
+    "WITH a AS (SELECT * FROM b), b AS (SELECT * FROM expenses WHERE user_id = 5) SELECT * FROM a",
+])
+def test_cte_names_do_not_hide_real_tables(sql):
+    rejected(sql)
+
+
+def test_cte_reading_another_table_by_a_shadowing_name_is_rejected():
+    assert "not accessible" in rejected("WITH users AS (SELECT * FROM users) SELECT * FROM users")
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH mine AS (SELECT * FROM expenses WHERE user_id = 5) SELECT category FROM mine",
+    "WITH expenses AS (SELECT * FROM expenses WHERE user_id = 5) SELECT * FROM expenses",
+    "WITH b AS (SELECT * FROM expenses WHERE user_id = 5), a AS (SELECT * FROM b) SELECT * FROM a",
+    "WITH RECURSIVE t(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM t WHERE n < 5) SELECT * FROM t",
+])
+def test_scoped_ctes_are_accepted(sql):
+    validate(sql, USER)
+
+
+@pytest.mark.parametrize("tail", [
+    "LIMIT ALL",
+    "LIMIT 100000",
+    f"LIMIT {SQL_MAX_ROWS + 1}",
+    "FETCH FIRST 100000 ROWS ONLY",
+    "LIMIT 5 + 100000",
+])
+def test_oversized_or_missing_limits_are_clamped(tail):
+    _, sql = validate(f"SELECT * FROM expenses WHERE user_id = 5 {tail}", USER)
+    assert sql.endswith(f"LIMIT {SQL_MAX_ROWS}")
+    assert "FETCH" not in sql and "ALL" not in sql
+
+
+def test_smaller_limit_is_kept():
+    _, sql = validate("SELECT * FROM expenses WHERE user_id = 5 LIMIT 10", USER)
+    assert sql.endswith("LIMIT 10")
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM users",
+    "SELECT * FROM public.users",
+    "SELECT * FROM pg_catalog.pg_user",
+    "SELECT * FROM other.expenses WHERE user_id = 5",
+    "SELECT pg_read_file('/etc/passwd') FROM expenses WHERE user_id = 5",
+    "SELECT current_setting('data_directory') FROM expenses WHERE user_id = 5",
+    "SELECT * FROM expenses WHERE user_id = 5 FOR UPDATE",
+    "SELECT * INTO copy FROM expenses WHERE user_id = 5",
+])
+def test_other_tables_functions_and_side_effects_are_rejected(sql):
+    rejected(sql)
+
+
+INSERT = "INSERT INTO expenses (user_id, category, amount, amount_type, date) VALUES "
+
+
+def test_literal_insert_is_accepted_and_returns_rollup_columns():
+    kind, sql = validate(INSERT + "(5, 'food', -1.5, 'debit', DATE '2025-01-01'), (5, 'pay', 10, 'CREDIT', CURRENT_DATE), "
+                                  "(5, 'tea', (3), 'DEBIT', '2025-01-02'::date), (5, 'misc', 1, 'DEBIT', NULL)", USER)
+    assert kind == "insert"
+    assert "'DEBIT'" in sql and "'debit'" not in sql
+    assert sql.endswith("RETURNING date, category, amount_type, amount")
+
+
+@pytest.mark.parametrize("cell", [
+    "pg_read_file('/etc/passwd')",
+    "current_setting('data_directory')",
+    "CAST(version() AS TEXT)",
+    "(SELECT category FROM expenses WHERE user_id = 6 LIMIT 1)",
+    "'a' || current_user",
+    "lower('FOOD')",
+])
+def test_insert_values_must_be_constants(cell):
+    assert "literal" in rejected(INSERT + f"(5, {cell}, 1, 'DEBIT', NULL)")
+
+
+@pytest.mark.parametrize("sql", [
+    INSERT + "(6, 'food', 1, 'DEBIT', NULL)",
+    INSERT + "(5, 'food', 1, 'REFUND', NULL)",
+    INSERT + "(5, 'food', 1, 'DEBIT')",
+    "INSERT INTO expenses VALUES (1, 5, 'food', 1, 'DEBIT', NULL)",
+    "INSERT INTO users (email, password) VALUES ('x', 'y')",
+    "INSERT INTO expenses (user_id, category, amount, amount_type, id) VALUES (5, 'food', 1, 'DEBIT', 1)",
+    "INSERT INTO expenses (user_id, category, amount, amount_type) SELECT user_id, category, amount, amount_type FROM expenses",
+    INSERT + "(5, 'food', 1, 'DEBIT', NULL) ON CONFLICT DO NOTHING",
+])
+def test_insert_shape_and_owner_are_enforced(sql):
+    rejected(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM expenses WHERE user_id = 5; DELETE FROM expenses",
+    "SELECT * FROM expenses WHERE user_id = 5; SELECT * FROM expenses WHERE user_id = 5",
+    "DELETE FROM expenses WHERE user_id = 5",
+    "UPDATE expenses SET amount = 0 WHERE user_id = 5",
+    "DROP TABLE expenses",
+    "WITH gone AS (DELETE FROM expenses WHERE user_id = 5 RETURNING *) SELECT * FROM gone",
+    "",
+])
+def test_only_one_select_or_insert_statement(sql):
+    rejected(sql)